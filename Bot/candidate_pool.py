@@ -0,0 +1,103 @@
+import threading
+
+# seconds after search in API when found people with the same search parameters are searched in API again
+POOL_TTL = 6 * 60 * 60
+
+# maximum seconds to wait for concurrent search in API with the same search parameters, then already saved found
+# people are used
+FETCH_WAIT_TIMEOUT = 5 * 60
+
+
+class CandidatePool:
+    """
+    Shared by all bot users pool of found people keyed by search parameters (city, gender, age). Found people are
+    stored in database, pool keeps time of last search in API for each key, so search with fresh pool does not call
+    API. Concurrent searches with the same key in this process are collapsed into one search in API (single-flight),
+    other searches wait for it and then read its results from database
+
+    Attributes:
+        db:         class DB object
+        ttl:        seconds after search in API when its results are considered outdated
+        wait_timeout:   maximum seconds to wait for concurrent search in API with the same key
+        in_flight:  dict with key as key and threading.Event object, set when search in API is over, as value
+        lock:       threading.Lock object protecting in_flight
+
+    Methods:
+        key: returns pool key for search parameters
+        is_fresh: checks whether people with search parameters were searched in API recently
+        begin_fetch: decides whether caller should search in API, waits for concurrent search with the same key
+        end_fetch: marks search in API as over
+    """
+
+    def __init__(self, db, ttl: float = POOL_TTL, wait_timeout: float = FETCH_WAIT_TIMEOUT) -> None:
+        """
+        Sets attributes db, ttl, wait_timeout, in_flight and lock for object CandidatePool
+        :param db: class DB object
+        :param ttl: seconds after search in API when its results are considered outdated
+        :param wait_timeout: maximum seconds to wait for concurrent search in API with the same key
+        """
+        self.db = db
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self.in_flight = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(requirement: dict) -> tuple:
+        """
+        Returns pool key for search parameters
+        :param requirement: dict with search parameters: gender, city, age
+        :return: tuple (city, gender, age)
+        """
+        return requirement['city'], requirement['gender'], requirement['age']
+
+    def is_fresh(self, requirement: dict) -> bool:
+        """
+        Checks whether people with search parameters were searched in API not earlier than ttl seconds ago
+        :param requirement: dict with search parameters: gender, city, age
+        :return: bool
+        """
+        return self.db.is_pool_fresh(requirement, self.ttl)
+
+    def begin_fetch(self, requirement: dict) -> bool:
+        """
+        Decides whether caller should search people in API. If search with the same key is already running, waits
+        until it is over, but not longer than wait_timeout seconds. Caller which got True must call end_fetch after
+        search, if freshness check fails key is released at once
+        :param requirement: dict with search parameters: gender, city, age
+        :return: True if caller should search in API, False if pool is fresh or concurrent search is over or timed out
+        """
+        key = self.key(requirement)
+        with self.lock:
+            event = self.in_flight.get(key)
+            if event is None:
+                self.in_flight[key] = threading.Event()
+
+        if event is not None:
+            event.wait(self.wait_timeout)
+            return False
+
+        try:
+            fresh = self.is_fresh(requirement)
+        except Exception:
+            self.end_fetch(requirement, fetched=False)
+            raise
+        if fresh:
+            self.end_fetch(requirement, fetched=False)
+            return False
+        return True
+
+    def end_fetch(self, requirement: dict, fetched: bool = True) -> None:
+        """
+        Marks search in API as over and wakes up waiting searches
+        :param requirement: dict with search parameters: gender, city, age
+        :param fetched: True if search was successful, then pool becomes fresh
+        :return:
+        """
+        try:
+            if fetched:
+                self.db.mark_pool_fetched(requirement)
+        finally:
+            with self.lock:
+                event = self.in_flight.pop(self.key(requirement))
+            event.set()
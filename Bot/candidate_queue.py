@@ -0,0 +1,155 @@
+import heapq
+import itertools
+import threading
+from typing import Callable, Optional
+
+
+class CandidateQueue:
+    """
+    Thread-safe priority queue of found users ids for one bot user. Background search pushes scored found users while
+    bot user watches already found ones, found user with the highest likeness index is given first.
+    Only ids are kept, found users profiles are read from database when they are shown
+
+    Attributes:
+        heap:       list of tuples (negative likeness index, push number, found user id) used as heap
+        counter:    itertools.count object, keeps push order for found users with equal index
+        ids:        set of ids of all ever pushed found users, same found user is not pushed twice
+        condition:  threading.Condition object to wait for found users
+        finished:   True when background search is over and no more found users will be pushed
+        current:    found user id given last, None before first one
+        on_change:  function called without arguments after found users are pushed, rescored or search is finished,
+                    None if not needed
+
+    Methods:
+        push: adds scored found users ids to queue
+        add_scores: increases likeness indexes of found users which are still in queue
+        pop: gives id of found user with the highest likeness index, waits for it if queue is empty
+        peek: returns ids of found users which will be given next without taking them
+        ranking: returns ids of all not given found users in order they would be given
+        discard: removes found users given by other bot process
+        finish: marks that no more found users will be pushed
+        changed: calls on_change function
+    """
+
+    def __init__(self) -> None:
+        """
+        Sets attributes heap, counter, ids, condition, finished, current and on_change for object CandidateQueue
+        """
+        self.heap = []
+        self.counter = itertools.count()
+        self.ids = set()
+        self.condition = threading.Condition()
+        self.finished = False
+        self.current = None
+        self.on_change: Optional[Callable] = None
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    def push(self, scores, found_users_ids: list) -> int:
+        """
+        Adds scored found users ids to queue, already pushed ones are skipped
+        :param scores: likeness indexes of found users
+        :param found_users_ids: list of found users ids
+        :return: quantity of added found users
+        """
+        added = 0
+        with self.condition:
+            for score, found_user_id in zip(scores, found_users_ids):
+                if found_user_id in self.ids:
+                    continue
+                self.ids.add(found_user_id)
+                heapq.heappush(self.heap, (-int(score), next(self.counter), found_user_id))
+                added += 1
+            if added:
+                self.condition.notify_all()
+        if added:
+            self.changed()
+        return added
+
+    def add_scores(self, points, found_users_ids: list) -> int:
+        """
+        Increases likeness indexes of found users which are still in queue, for example by points for mutual friends
+        and groups evaluated after found users were pushed. Already given found users are skipped
+        :param points: points added to likeness indexes of found users
+        :param found_users_ids: list of found users ids
+        :return: quantity of updated found users
+        """
+        points_dict = {found_user_id: int(point) for point, found_user_id in zip(points, found_users_ids) if point}
+        if not points_dict:
+            return 0
+
+        updated = 0
+        with self.condition:
+            for i, (score, number, found_user_id) in enumerate(self.heap):
+                if found_user_id in points_dict:
+                    self.heap[i] = (score - points_dict[found_user_id], number, found_user_id)
+                    updated += 1
+            if updated:
+                heapq.heapify(self.heap)
+        if updated:
+            self.changed()
+        return updated
+
+    def pop(self, timeout: Optional[float] = None) -> Optional[int]:
+        """
+        Gives id of found user with the highest likeness index and makes him current. If queue is empty waits until
+        found users are pushed or search is finished
+        :param timeout: maximum seconds to wait, waits without limit if not passed
+        :return: found user id, None if search is finished and queue is empty or timeout expired
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.heap or self.finished, timeout)
+            if not self.heap:
+                return None
+            self.current = heapq.heappop(self.heap)[2]
+            return self.current
+
+    def peek(self, n: int) -> list:
+        """
+        Returns ids of n found users with the highest likeness index without taking them from queue, they may change
+        if found users with higher index are pushed later
+        :param n: quantity of ids
+        :return: list of found users ids in order they would be given
+        """
+        with self.condition:
+            return [item[2] for item in heapq.nsmallest(n, self.heap)]
+
+    def ranking(self) -> list:
+        """
+        Returns ids of all not given found users in order they would be given
+        :return: list of found users ids
+        """
+        with self.condition:
+            return [item[2] for item in sorted(self.heap)]
+
+    def discard(self, found_users_ids: list) -> None:
+        """
+        Removes found users which were given by other bot process from queue
+        :param found_users_ids: list of found users ids
+        :return:
+        """
+        discarded = set(found_users_ids)
+        if not discarded:
+            return
+        with self.condition:
+            self.heap = [item for item in self.heap if item[2] not in discarded]
+            heapq.heapify(self.heap)
+
+    def finish(self) -> None:
+        """
+        Marks that background search is over and wakes up waiting bot user
+        :return:
+        """
+        with self.condition:
+            self.finished = True
+            self.condition.notify_all()
+        self.changed()
+
+    def changed(self) -> None:
+        """
+        Calls on_change function if it is set, must be called without lock
+        :return:
+        """
+        if self.on_change is not None:
+            self.on_change()
@@ -0,0 +1,170 @@
+import itertools
+import time
+import traceback
+from typing import Iterable, Optional
+
+from VK.vkontakte import VkontakteApi
+from DB.database import DB
+from Bot.candidate_pool import CandidatePool
+import keyboard.keyboard as kb
+
+# quantity of people whose photos are fetched (10 execute requests sent by PHOTO_WORKERS threads at the same time)
+# and written to database at once
+CRAWL_BATCH_SIZE = 120
+
+# genders ids used in VK database (1 - female, 2 - male)
+CRAWL_GENDERS = (1, 2)
+
+# default maximum rate of crawler API calls, bot calls API with the same token at the same time, so together with
+# bot default (see Bot.vk_bot.BOT_REQUESTS_PER_SECOND) it makes VK limit of 3 requests per second
+CRAWL_REQUESTS_PER_SECOND = 1
+
+# default seconds between crawls of all search keys
+CRAWL_INTERVAL = 60 * 60
+
+# default seconds after receipt from API when found user profile and photos are refreshed
+REFRESH_AGE = 7 * 24 * 60 * 60
+
+# default maximum quantity of found users refreshed after each crawl
+REFRESH_LIMIT = 10000
+
+
+class Crawler:
+    """
+    Background crawler which pre-populates founduser and photo tables for popular search parameters (cities and ages
+    offered on bot keyboard, both genders), so interactive searches of bot users are mostly database reads.
+    Search keys are shared with bot through searchpool table: fresh keys are skipped by crawler, and keys crawled
+    recently are not searched in API by bot. Already saved found users are not searched again, instead outdated
+    ones are refreshed in bulk
+
+    Attributes:
+        apivk:      class VkontakteApi object with own rate limit
+        db:         class DB object
+        pool:       class CandidatePool object
+        cities:     ids of crawled cities
+        ages:       crawled ages
+        genders:    crawled genders ids
+
+    Methods:
+        search_keys: returns search parameters dicts of all crawled keys
+        crawl_key: searches people with one search parameters and saves them with photos to database
+        crawl: crawls all not fresh search keys
+        refresh: refreshes profiles and photos of outdated found users
+        run: crawls search keys and refreshes found users forever with interval
+    """
+
+    def __init__(self, apivk: VkontakteApi, db: DB, pool: CandidatePool, cities: Optional[Iterable[int]] = None,
+                 ages: Optional[Iterable[int]] = None, genders: Iterable[int] = CRAWL_GENDERS) -> None:
+        """
+        Sets attributes apivk, db, pool, cities, ages and genders for object Crawler
+        :param apivk: class VkontakteApi object
+        :param db: class DB object
+        :param pool: class CandidatePool object
+        :param cities: ids of crawled cities, cities from bot keyboard if not passed
+        :param ages: crawled ages, ages from bot keyboard if not passed
+        :param genders: crawled genders ids
+        """
+        self.apivk = apivk
+        self.db = db
+        self.pool = pool
+        self.cities = list(cities or kb.CITIES.values())
+        self.ages = list(ages or kb.AGES)
+        self.genders = list(genders)
+
+    def search_keys(self) -> list:
+        """
+        Returns search parameters of all crawled keys, keys of one city go one after another
+        :return: list of dicts with search parameters: gender, city, age
+        """
+        return [{'gender': gender, 'city': city, 'age': age}
+                for city, age, gender in itertools.product(self.cities, self.ages, self.genders)]
+
+    def crawl_key(self, search_info_dict: dict) -> Optional[int]:
+        """
+        Searches people with search parameters in API, fetches top 3 photos of people not saved in database yet and
+        writes them to database in batches. Key is skipped if it is fresh or is searched by bot at the moment
+        :param search_info_dict: dict with search parameters: gender, city, age
+        :return: quantity of written found users, None if key was skipped
+        """
+        if not self.pool.begin_fetch(search_info_dict):
+            return None
+
+        fetched = False
+        written = 0
+        try:
+            people_list = self.apivk.search_many_people(search_info_dict['city'], search_info_dict['gender'],
+                                                        search_info_dict['age'])
+            known_ids = self.db.query_found_user_ids([person['id'] for person in people_list])
+            people_list = [person for person in people_list if person['id'] not in known_ids]
+
+            for i in range(0, len(people_list), CRAWL_BATCH_SIZE):
+                batch = self.apivk.prepare_found_users_info(people_list[i:i + CRAWL_BATCH_SIZE])
+                if batch and self.db.write_found_users_bulk(batch):
+                    written += len(batch)
+            fetched = True
+        finally:
+            self.pool.end_fetch(search_info_dict, fetched)
+        return written
+
+    def crawl(self) -> dict:
+        """
+        Crawls all search keys, error in one key does not stop crawling of next ones
+        :return: dict with search key tuple as key and quantity of written found users as value, skipped keys are
+        not included
+        """
+        result = {}
+        for search_info_dict in self.search_keys():
+            try:
+                written = self.crawl_key(search_info_dict)
+            except Exception:
+                traceback.print_exc()
+                continue
+            if written is not None:
+                result[self.pool.key(search_info_dict)] = written
+        return result
+
+    def refresh(self, max_age: float = REFRESH_AGE, limit: int = REFRESH_LIMIT) -> tuple:
+        """
+        Refreshes found users received from API more than max_age seconds ago, most viewed ones first. Profiles are
+        received by users.get (1000 users per request) and top 3 photos by batched execute requests, then found users
+        and their photos are rewritten in database. Found users whose profiles are deleted, closed, lost birthdate or
+        city, or have less than 3 photos are hidden from search
+        :param max_age: seconds after receipt from API when found user is considered outdated
+        :param limit: maximum quantity of refreshed found users
+        :return: tuple of quantities of refreshed and hidden found users
+        """
+        ids = self.db.read_stale_found_user_ids(max_age, limit)
+        people_list = self.apivk.get_users_info_batch(ids)
+
+        refreshed = set()
+        for i in range(0, len(people_list), CRAWL_BATCH_SIZE):
+            batch = self.apivk.prepare_found_users_info(people_list[i:i + CRAWL_BATCH_SIZE])
+            if batch and self.db.write_found_users_bulk(batch):
+                refreshed.update(person['id_user'] for person in batch)
+
+        hidden = [found_user_id for found_user_id in ids if found_user_id not in refreshed]
+        self.db.hide_found_users(hidden)
+        return len(refreshed), len(hidden)
+
+    def run(self, interval: float = CRAWL_INTERVAL, max_age: float = REFRESH_AGE,
+            limit: int = REFRESH_LIMIT) -> None:
+        """
+        Crawls search keys and refreshes outdated found users forever, sleeps interval seconds between crawls
+        :param interval: seconds between crawls of all search keys
+        :param max_age: seconds after receipt from API when found user is considered outdated
+        :param limit: maximum quantity of found users refreshed after each crawl
+        :return:
+        """
+        while True:
+            started = time.monotonic()
+            result = self.crawl()
+            print(f'crawled {len(result)} keys, written {sum(result.values())} found users '
+                  f'in {time.monotonic() - started:.0f} s')
+
+            started = time.monotonic()
+            try:
+                refreshed, hidden = self.refresh(max_age, limit)
+                print(f'refreshed {refreshed} found users, hidden {hidden} in {time.monotonic() - started:.0f} s')
+            except Exception:
+                traceback.print_exc()
+            time.sleep(interval)
@@ -0,0 +1,74 @@
+import threading
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+
+class UserDispatcher:
+    """
+    Runs handlers of bot users events in thread pool. Handlers of different users run concurrently, so slow search of
+    one user does not block other users, handlers of one user run one by one in order of events arrival
+
+    Attributes:
+        executor:   concurrent.futures.ThreadPoolExecutor object running handlers
+        queues:     dict with user id as key and deque of not finished handlers of this user as value
+        lock:       threading.Lock object protecting queues
+
+    Methods:
+        submit: adds handler of users event
+        run_user_queue: runs handlers of one user one by one until his queue is empty
+        shutdown: waits for running handlers and stops threads
+    """
+
+    def __init__(self, max_workers: int) -> None:
+        """
+        Sets attributes executor, queues and lock for object UserDispatcher
+        :param max_workers: quantity of threads, maximum quantity of users whose events are handled at the same time
+        """
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.queues = {}
+        self.lock = threading.Lock()
+
+    def submit(self, uid: int, handler: Callable, *args) -> None:
+        """
+        Adds handler of users event, it runs after all previously added handlers of this user
+        :param uid: user id
+        :param handler: function handling event
+        :param args: handler arguments
+        :return:
+        """
+        with self.lock:
+            queue = self.queues.setdefault(uid, deque())
+            queue.append((handler, args))
+            if len(queue) == 1:
+                self.executor.submit(self.run_user_queue, uid)
+
+    def run_user_queue(self, uid: int) -> None:
+        """
+        Runs handlers of one user one by one until his queue is empty, error in one handler does not stop next ones
+        :param uid: user id
+        :return:
+        """
+        while True:
+            with self.lock:
+                handler, args = self.queues[uid][0]
+
+            try:
+                handler(*args)
+            except Exception:
+                traceback.print_exc()
+
+            with self.lock:
+                queue = self.queues[uid]
+                queue.popleft()
+                if not queue:
+                    del self.queues[uid]
+                    return
+
+    def shutdown(self) -> None:
+        """
+        Waits for running handlers and stops threads
+        :return:
+        """
+        self.executor.shutdown(wait=True)
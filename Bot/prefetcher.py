@@ -0,0 +1,111 @@
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from Bot.state_store import MemoryStateStore
+
+# quantity of next found users prepared while bot user views current one
+PREFETCH_DEPTH = 3
+
+# quantity of threads preparing found users
+PREFETCH_WORKERS = 2
+
+
+class PersonPrefetcher:
+    """
+    Prepares in background data and message payloads of found users which bot user will see next, so showing next
+    found user costs only one message send
+
+    Attributes:
+        loader:     function returning list of prepared found users dicts (with 'id_user' key) for list of ids
+        depth:      quantity of found users prepared for each bot user
+        executor:   concurrent.futures.ThreadPoolExecutor object running loader
+        prepared:   MemoryStateStore with bot user id as key and dict with found user id as key and prepared found user
+                    as value (None while found user is being prepared)
+        lock:       threading.Lock object protecting prepared dicts
+
+    Methods:
+        prefetch: starts preparing of found users which are not prepared yet
+        load: prepares found users and saves them for bot user
+        take: returns prepared found user
+        discard: forgets prepared found users of bot user
+    """
+
+    def __init__(self, loader: Callable, depth: int = PREFETCH_DEPTH, max_workers: int = PREFETCH_WORKERS) -> None:
+        """
+        Sets attributes loader, depth, executor, prepared and lock for object PersonPrefetcher
+        :param loader: function returning list of prepared found users dicts for list of ids
+        :param depth: quantity of found users prepared for each bot user
+        :param max_workers: quantity of threads preparing found users
+        """
+        self.loader = loader
+        self.depth = depth
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.prepared = MemoryStateStore()
+        self.lock = threading.Lock()
+
+    def prefetch(self, uid: int, found_users_ids: list) -> None:
+        """
+        Starts preparing of found users which bot user will see next, prepared found users which are not among them
+        any more are forgotten
+        :param uid: bot user id
+        :param found_users_ids: ids of found users in order they will be shown, only first depth ones are prepared
+        :return:
+        """
+        window = found_users_ids[:self.depth]
+        with self.lock:
+            prepared = self.prepared.get(uid) or {}
+            prepared = {found_user_id: prepared.get(found_user_id) for found_user_id in window
+                        if found_user_id in prepared}
+            missing = [found_user_id for found_user_id in window if found_user_id not in prepared]
+            prepared.update((found_user_id, None) for found_user_id in missing)
+            self.prepared[uid] = prepared
+        if missing:
+            self.executor.submit(self.load, uid, missing)
+
+    def load(self, uid: int, found_users_ids: list) -> None:
+        """
+        Prepares found users and saves them for bot user if they are still expected
+        :param uid: bot user id
+        :param found_users_ids: ids of found users
+        :return:
+        """
+        try:
+            persons = self.loader(found_users_ids)
+        except Exception:
+            traceback.print_exc()
+            persons = []
+
+        with self.lock:
+            prepared = self.prepared.get(uid)
+            if prepared is None:
+                return
+            for person in persons:
+                if person['id_user'] in prepared:
+                    prepared[person['id_user']] = person
+            for found_user_id in found_users_ids:
+                if prepared.get(found_user_id, False) is None:
+                    del prepared[found_user_id]
+
+    def take(self, uid: int, found_user_id: int) -> Optional[dict]:
+        """
+        Returns prepared found user and forgets him
+        :param uid: bot user id
+        :param found_user_id: found user id
+        :return: prepared found user dict, None if he is not prepared yet
+        """
+        with self.lock:
+            prepared = self.prepared.get(uid)
+            if not prepared:
+                return None
+            return prepared.pop(found_user_id, None)
+
+    def discard(self, uid: int) -> None:
+        """
+        Forgets prepared found users of bot user
+        :param uid: bot user id
+        :return:
+        """
+        with self.lock:
+            del self.prepared[uid]
@@ -0,0 +1,500 @@
+import threading
+import traceback
+from collections import OrderedDict
+from time import monotonic, sleep
+from typing import Optional
+from uuid import uuid4
+
+from Bot.candidate_queue import CandidateQueue
+
+# default maximum quantity of bot users whose state is kept in memory
+STATE_MAX_SIZE = 10000
+
+# default seconds of inactivity after which bot users state is evicted
+STATE_TTL = 24 * 60 * 60
+
+# seconds between deletions of expired states from database
+STATE_PURGE_INTERVAL = 10 * 60
+
+# seconds between checks of shared ranking while bot user waits for found users searched by other process
+QUEUE_POLL_INTERVAL = 0.5
+
+# seconds between heartbeats of bot process which saves shared rankings
+OWNER_HEARTBEAT_INTERVAL = 20
+
+# seconds without heartbeat after which bot process is considered stopped, its not finished rankings are finished
+OWNER_TTL = 60
+
+_MISSING = object()
+
+
+class MemoryStateStore:
+    """
+    Thread-safe dict-like store of bot users state in process memory. State is evicted when it is not used during
+    ttl seconds or when store is full and state was used least recently
+
+    Attributes:
+        max_size:   maximum quantity of kept states
+        ttl:        seconds after last use when state is evicted
+        items:      OrderedDict with key as key and tuple (expiration time, state) as value, least recently used first
+        lock:       threading.Lock object protecting items
+
+    Methods:
+        get: returns state, default if it is absent or expired
+        compare_and_set: replaces state only if its fields are equal to expected ones
+        evict: deletes expired and least recently used states
+    """
+
+    def __init__(self, max_size: int = STATE_MAX_SIZE, ttl: float = STATE_TTL) -> None:
+        """
+        Sets attributes max_size, ttl, items and lock for object MemoryStateStore
+        :param max_size: maximum quantity of kept states
+        :param ttl: seconds after last use when state is evicted
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Returns state, marks it as recently used and prolongs its expiration
+        :param key: state key (bot user id)
+        :param default: value returned if state is absent or expired
+        :return: state
+        """
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return default
+            if item[0] <= monotonic():
+                del self.items[key]
+                return default
+            self.items[key] = (monotonic() + self.ttl, item[1])
+            self.items.move_to_end(key)
+            return item[1]
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value) -> None:
+        with self.lock:
+            self.items[key] = (monotonic() + self.ttl, value)
+            self.items.move_to_end(key)
+            self.evict()
+
+    def __delitem__(self, key) -> None:
+        with self.lock:
+            self.items.pop(key, None)
+
+    def __contains__(self, key) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def compare_and_set(self, key, value, expected: dict) -> bool:
+        """
+        Replaces state only if it is not expired and its fields are equal to expected ones, check and replacement are
+        done under lock
+        :param key: state key (bot user id)
+        :param value: new state
+        :param expected: dict with state field as key and its expected value as value
+        :return: True if state was replaced
+        """
+        with self.lock:
+            item = self.items.get(key)
+            if item is None or item[0] <= monotonic():
+                return False
+            if any(item[1].get(field) != expected_value for field, expected_value in expected.items()):
+                return False
+            self.items[key] = (monotonic() + self.ttl, value)
+            self.items.move_to_end(key)
+            return True
+
+    def evict(self) -> None:
+        """
+        Deletes least recently used states while store is overfilled or they are expired, must be called under lock
+        :return:
+        """
+        now = monotonic()
+        while self.items:
+            expiration, _ = next(iter(self.items.values()))
+            if len(self.items) <= self.max_size and expiration > now:
+                return
+            self.items.popitem(last=False)
+
+
+class PostgresStateStore:
+    """
+    Dict-like store of bot users state in database table botstate. State is kept after bot restart and is shared by
+    all bot processes working with the same database. State is evicted when it is not updated during ttl seconds,
+    state must be JSON serializable
+
+    Attributes:
+        db:         class DB object
+        namespace:  str, prefix of state id in table, separates stores of different kind of state
+        ttl:        seconds after last update when state is evicted
+        purged:     time of last deletion of expired states
+
+    Methods:
+        get: returns state, default if it is absent or expired
+        compare_and_set: replaces state only if its fields are equal to expected ones
+        state_id: returns id of state in table
+    """
+
+    def __init__(self, db, namespace: str, ttl: float = STATE_TTL) -> None:
+        """
+        Sets attributes db, namespace, ttl and purged for object PostgresStateStore
+        :param db: class DB object
+        :param namespace: prefix of state id in table
+        :param ttl: seconds after last update when state is evicted
+        """
+        self.db = db
+        self.namespace = namespace
+        self.ttl = ttl
+        self.purged = monotonic()
+
+    def state_id(self, key) -> str:
+        """
+        Returns id of state in table
+        :param key: state key (bot user id)
+        :return: id in form namespace_key
+        """
+        return f'{self.namespace}_{key}'
+
+    def get(self, key, default=None):
+        """
+        Returns state from database
+        :param key: state key (bot user id)
+        :param default: value returned if state is absent or expired
+        :return: state
+        """
+        value = self.db.read_state(self.state_id(key))
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value) -> None:
+        self.db.write_state(self.state_id(key), value, self.ttl)
+        if monotonic() - self.purged > STATE_PURGE_INTERVAL:
+            self.purged = monotonic()
+            self.db.delete_expired_states()
+
+    def __delitem__(self, key) -> None:
+        self.db.delete_state(self.state_id(key))
+
+    def __contains__(self, key) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def compare_and_set(self, key, value, expected: dict) -> bool:
+        """
+        Replaces state only if it is not expired and its fields are equal to expected ones, check and replacement are
+        done by one conditional UPDATE, so state changed by other bot process is not overwritten
+        :param key: state key (bot user id)
+        :param value: new JSON serializable state
+        :param expected: dict with state field as key and its expected not None value as value
+        :return: True if state was replaced
+        """
+        return self.db.compare_and_set_state(self.state_id(key), value, expected, self.ttl)
+
+
+class CandidateQueueStore:
+    """
+    Store of bot users CandidateQueue objects. Queues filled by background search are kept in memory of process which
+    runs search. If shared stores are set, found users are given from ranking saved in shared store instead of local
+    queue: process running search saves ids of not given found users in order they would be given as new version of
+    ranking after each change of queue, and each shown found user only moves saved cursor (version of ranking,
+    position in it and current found user id). Cursor is moved by compare-and-set on its version and position, so
+    concurrent moves and saving of new version are not lost. So after restart or in other bot process bot user
+    continues watching found users from the same place, and found users given by one process are not given by other.
+    Ranking keeps id of process which saved it, process writes heartbeat while it works, so ranking of stopped
+    process (or of evicted local queue) is considered finished and bot user is not left waiting for search forever
+
+    Attributes:
+        queues:     MemoryStateStore object with CandidateQueue objects
+        rankings:   store with saved rankings keyed by bot user id and version, None if queues are not shared
+        cursors:    store with saved cursors, None if queues are not shared
+        owners:     store with heartbeats of working bot processes, None if queues are not shared
+        owner:      id of this bot process
+        cache:      MemoryStateStore object with last read or saved ranking of each bot user
+        lock:       threading.Lock object, rankings of this process are saved one at a time
+
+    Methods:
+        pop: gives id of next found user
+        peek: returns ids of found users which will be given next
+        current: returns id of found user given last
+        finished: checks whether no more found users will be given except already ranked ones
+        read: returns saved cursor and ranking of bot user
+        ranking: returns saved ranking of bot user with given version
+        publish: saves ranking of bot users local queue
+        ranking_key: returns key of ranking in rankings store
+        is_over: checks whether ranking will not be changed any more
+        beat: writes heartbeat of this bot process
+        run: writes heartbeat forever with interval
+        start: starts background thread writing heartbeat
+    """
+
+    def __init__(self, queues: MemoryStateStore, rankings=None, cursors=None, owners=None) -> None:
+        """
+        Sets attributes queues, rankings, cursors, owners, owner, cache and lock for object CandidateQueueStore
+        :param queues: MemoryStateStore object for CandidateQueue objects
+        :param rankings: MemoryStateStore or PostgresStateStore object for rankings, None if queues are not shared
+        :param cursors: MemoryStateStore or PostgresStateStore object for cursors, None if queues are not shared
+        :param owners: MemoryStateStore or PostgresStateStore object with ttl OWNER_TTL for heartbeats, None if queues
+        are not shared
+        """
+        self.queues = queues
+        self.rankings = rankings
+        self.cursors = cursors
+        self.owners = owners
+        self.owner = uuid4().hex
+        self.cache = MemoryStateStore(queues.max_size, queues.ttl)
+        self.lock = threading.Lock()
+
+    @property
+    def shared(self) -> bool:
+        return self.rankings is not None
+
+    @staticmethod
+    def ranking_key(uid: int, version: str) -> str:
+        return f'{uid}_{version}'
+
+    def __setitem__(self, uid: int, queue: CandidateQueue) -> None:
+        del self[uid]
+        self.queues[uid] = queue
+        if self.shared:
+            queue.on_change = lambda: self.publish(uid)
+            self.publish(uid)
+
+    def __delitem__(self, uid: int) -> None:
+        del self.queues[uid]
+        del self.cache[uid]
+        if self.shared:
+            cursor = self.cursors.get(uid)
+            if cursor is not None:
+                del self.rankings[self.ranking_key(uid, cursor['version'])]
+            del self.cursors[uid]
+
+    def __contains__(self, uid: int) -> bool:
+        if self.shared:
+            return uid in self.cursors
+        return uid in self.queues
+
+    def pop(self, uid: int, timeout: Optional[float] = None) -> Optional[int]:
+        """
+        Gives id of next found user and makes him current, waits for him if all ranked found users are given and
+        search continues. Cursor is moved only if it was not moved by other process or by saving of new ranking
+        version since it was read, otherwise it is read again
+        :param uid: bot user id
+        :param timeout: maximum seconds to wait, waits without limit if not passed
+        :return: found user id, None if search is finished and all found users are given or timeout expired
+        """
+        if not self.shared:
+            return self.queues[uid].pop(timeout)
+
+        deadline = None if timeout is None else monotonic() + timeout
+        while True:
+            cursor, ranking = self.read(uid)
+            if ranking is not None and cursor['position'] < len(ranking['ids']):
+                found_user_id = ranking['ids'][cursor['position']]
+                moved = {**cursor, 'position': cursor['position'] + 1, 'current': found_user_id}
+                if self.cursors.compare_and_set(uid, moved, {'version': cursor['version'],
+                                                             'position': cursor['position']}):
+                    return found_user_id
+                continue
+            if ranking is None or self.is_over(uid, ranking):
+                return None
+
+            delay = QUEUE_POLL_INTERVAL if deadline is None else min(QUEUE_POLL_INTERVAL, deadline - monotonic())
+            if delay <= 0:
+                return None
+            sleep(delay)
+
+    def peek(self, uid: int, n: int) -> list:
+        """
+        Returns ids of n found users which will be given next without taking them
+        :param uid: bot user id
+        :param n: quantity of ids
+        :return: list of found users ids in order they would be given
+        """
+        if not self.shared:
+            return self.queues[uid].peek(n)
+
+        cursor, ranking = self.read(uid)
+        if ranking is None:
+            return []
+        return ranking['ids'][cursor['position']:cursor['position'] + n]
+
+    def current(self, uid: int) -> Optional[int]:
+        """
+        Returns id of found user given last
+        :param uid: bot user id
+        :return: found user id, None before first one
+        """
+        if not self.shared:
+            return self.queues[uid].current
+        return self.cursors[uid]['current']
+
+    def finished(self, uid: int) -> bool:
+        """
+        Checks whether background search is over, so no more found users will be given except already ranked ones
+        :param uid: bot user id
+        :return: bool
+        """
+        if not self.shared:
+            return self.queues[uid].finished
+        _, ranking = self.read(uid)
+        return ranking is None or self.is_over(uid, ranking)
+
+    def read(self, uid: int) -> tuple:
+        """
+        Returns saved cursor of bot user and ranking of its version. If ranking is absent because new version was
+        saved after cursor was read, cursor is read again
+        :param uid: bot user id
+        :return: tuple (cursor dict with keys version, position, current or None, ranking dict or None)
+        """
+        cursor = self.cursors.get(uid)
+        while cursor is not None:
+            ranking = self.ranking(uid, cursor['version'])
+            if ranking is not None:
+                return cursor, ranking
+            latest = self.cursors.get(uid)
+            if latest is None or latest['version'] == cursor['version']:
+                return latest, None
+            cursor = latest
+        return None, None
+
+    def ranking(self, uid: int, version: str) -> Optional[dict]:
+        """
+        Returns saved ranking of bot user, it is read from shared store only when its version is changed
+        :param uid: bot user id
+        :param version: version of ranking from cursor
+        :return: dict with keys version, ids, finished, owner, None if ranking is absent
+        """
+        ranking = self.cache.get(uid)
+        if ranking is None or ranking['version'] != version:
+            ranking = self.rankings.get(self.ranking_key(uid, version))
+            if ranking is None:
+                return None
+            self.cache[uid] = ranking
+        return ranking
+
+    def publish(self, uid: int) -> None:
+        """
+        Saves ranking of bot users local queue as new version. Found users given from previous version (in any
+        process) are removed from queue first, then cursor is moved to the beginning of new version if it was not
+        moved since it was read, otherwise it is done again. Previous version is deleted after cursor is moved
+        :param uid: bot user id
+        :return:
+        """
+        queue = self.queues.get(uid)
+        if queue is None:
+            return
+
+        with self.lock:
+            while True:
+                cursor, published = self.read(uid)
+                if published is not None:
+                    queue.discard(published['ids'][:cursor['position']])
+
+                ranking = {'version': uuid4().hex, 'ids': queue.ranking(), 'finished': queue.finished,
+                           'owner': self.owner}
+                self.rankings[self.ranking_key(uid, ranking['version'])] = ranking
+                moved = {'version': ranking['version'], 'position': 0,
+                         'current': cursor['current'] if cursor is not None else None}
+                if cursor is None:
+                    self.cursors[uid] = moved
+                elif not self.cursors.compare_and_set(uid, moved, {'version': cursor['version'],
+                                                                   'position': cursor['position']}):
+                    del self.rankings[self.ranking_key(uid, ranking['version'])]
+                    continue
+                else:
+                    del self.rankings[self.ranking_key(uid, cursor['version'])]
+                self.cache[uid] = ranking
+                return
+
+    def is_over(self, uid: int, ranking: dict) -> bool:
+        """
+        Checks whether ranking will not be changed any more: search is finished or process which saved ranking has
+        stopped (its heartbeat is expired) or has lost local queue
+        :param uid: bot user id
+        :param ranking: saved ranking of bot user
+        :return: bool
+        """
+        if ranking['finished']:
+            return True
+        if ranking['owner'] == self.owner:
+            return uid not in self.queues
+        return ranking['owner'] not in self.owners
+
+    def beat(self) -> None:
+        """
+        Writes heartbeat of this bot process, it expires after OWNER_TTL seconds
+        :return:
+        """
+        self.owners[self.owner] = True
+
+    def run(self, interval: float = OWNER_HEARTBEAT_INTERVAL) -> None:
+        """
+        Writes heartbeat of this bot process every interval seconds, error in one write does not stop next ones
+        :param interval: seconds between heartbeats
+        :return:
+        """
+        while True:
+            try:
+                self.beat()
+            except Exception:
+                traceback.print_exc()
+            sleep(interval)
+
+    def start(self) -> None:
+        """
+        Starts background daemon thread writing heartbeat of this bot process, needed only if queues are shared
+        :return:
+        """
+        if self.shared:
+            threading.Thread(target=self.run, daemon=True).start()
+
+
+def create_state_store(namespace: str, db=None, backend: str = 'memory', max_size: int = STATE_MAX_SIZE,
+                       ttl: float = STATE_TTL):
+    """
+    Creates store of bot users state
+    :param namespace: name of stored state
+    :param db: class DB object, needed for postgres backend
+    :param backend: 'memory' for MemoryStateStore or 'postgres' for PostgresStateStore
+    :param max_size: maximum quantity of states kept in memory
+    :param ttl: seconds after last update when state is evicted
+    :return: MemoryStateStore or PostgresStateStore object
+    """
+    if backend == 'memory':
+        return MemoryStateStore(max_size, ttl)
+    if backend == 'postgres':
+        return PostgresStateStore(db, namespace, ttl)
+    raise ValueError(f'Unknown state backend: {backend}')
+
+
+def create_candidate_queue_store(db=None, backend: str = 'memory', max_size: int = STATE_MAX_SIZE,
+                                 ttl: float = STATE_TTL) -> CandidateQueueStore:
+    """
+    Creates store of bot users CandidateQueue objects, queues are shared through rankings and cursors only for
+    postgres backend
+    :param db: class DB object, needed for postgres backend
+    :param backend: 'memory' or 'postgres'
+    :param max_size: maximum quantity of queues kept in memory
+    :param ttl: seconds after last update when queue is evicted
+    :return: CandidateQueueStore object
+    """
+    queues = MemoryStateStore(max_size, ttl)
+    if backend == 'postgres':
+        return CandidateQueueStore(queues, create_state_store('candidates_ranking', db, backend, max_size, ttl),
+                                   create_state_store('candidates_cursor', db, backend, max_size, ttl),
+                                   create_state_store('candidates_owner', db, backend, max_size, OWNER_TTL))
+    if backend != 'memory':
+        raise ValueError(f'Unknown state backend: {backend}')
+    return CandidateQueueStore(queues)
@@ -0,0 +1,83 @@
+import threading
+import traceback
+from collections import Counter
+from time import sleep
+
+# seconds between writes of counted views to database
+VIEWS_FLUSH_INTERVAL = 60
+
+
+class ViewCounter:
+    """
+    Counts views of found users by bot users in process memory and writes them to database in bulk in background
+    thread, so showing found user does not wait for database update
+
+    Attributes:
+        db:         class DB object
+        interval:   seconds between writes of counted views to database
+        views:      collections.Counter object with found user id as key and not written views quantity as value
+        lock:       threading.Lock object protecting views
+
+    Methods:
+        add: counts view of found user
+        flush: writes counted views to database
+        run: writes counted views to database forever with interval
+        start: starts background thread writing counted views
+    """
+
+    def __init__(self, db, interval: float = VIEWS_FLUSH_INTERVAL) -> None:
+        """
+        Sets attributes db, interval, views and lock for object ViewCounter
+        :param db: class DB object
+        :param interval: seconds between writes of counted views to database
+        """
+        self.db = db
+        self.interval = interval
+        self.views = Counter()
+        self.lock = threading.Lock()
+
+    def add(self, found_user_id: int) -> None:
+        """
+        Counts view of found user, it is written to database with next flush
+        :param found_user_id: found user id
+        :return:
+        """
+        with self.lock:
+            self.views[found_user_id] += 1
+
+    def flush(self) -> int:
+        """
+        Writes counted views to database in one statement, views are kept for next flush if writing failed
+        :return: quantity of found users whose views were written
+        """
+        with self.lock:
+            views, self.views = self.views, Counter()
+        if not views:
+            return 0
+
+        try:
+            self.db.count_found_user_views(dict(views))
+        except Exception:
+            with self.lock:
+                self.views.update(views)
+            raise
+        return len(views)
+
+    def run(self) -> None:
+        """
+        Writes counted views to database every interval seconds, error in one write does not stop next ones
+        :return:
+        """
+        while True:
+            sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                traceback.print_exc()
+
+    def start(self) -> None:
+        """
+        Starts background daemon thread writing counted views to database
+        :return:
+        """
+        threading.Thread(target=self.run, daemon=True).start()
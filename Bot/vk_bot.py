@@ -1,3 +1,8 @@
+import threading
+from time import perf_counter, sleep
+from typing import Optional
+
+import numpy as np
 import vk_api
 from vk_api.longpoll import VkLongPoll, VkEventType
 from vk_api.utils import get_random_id
@@ -5,10 +10,43 @@ from vk_api.utils import get_random_id
 from VK.vkontakte import VkontakteApi
 from DB.database import DB
 from interests.interests import InterestsComparison
+from interests.batch_scoring import BatchScoring
+from Bot.candidate_queue import CandidateQueue
+from Bot.candidate_pool import CandidatePool
+from Bot.dispatcher import UserDispatcher
+from Bot.state_store import create_state_store, create_candidate_queue_store
+from Bot.prefetcher import PersonPrefetcher, PREFETCH_DEPTH
+from Bot.view_counter import ViewCounter
 import keyboard.keyboard as kb
 
-import nltk
-from nltk.corpus import stopwords
+# quantity of people proceeded by background search at once (one execute request for photos)
+SEARCH_BATCH_SIZE = 12
+
+# seconds to wait for next found person if all found people are already shown and search continues
+NEXT_PERSON_TIMEOUT = 10
+
+# seconds to wait for first found person after search is launched, dispatcher worker is not held longer
+FIRST_PERSON_TIMEOUT = 30
+
+# default maximum rate of bot API calls with users token, together with crawler (see crawler.py) it must not exceed
+# VK limit of 3 requests per second
+BOT_REQUESTS_PER_SECOND = 2
+
+# seconds between reports of interests normalization caches statistics
+CACHE_REPORT_INTERVAL = 60 * 60
+
+# quantity of bot users whose commands are executed at the same time
+BOT_WORKERS = 8
+
+# quantity of best matching cached found users read when likeness index is evaluated by database, 0 means that all
+# cached found users are read and evaluated in Python
+SQL_SCORING_LIMIT = 0
+
+# quantity of best matching cached found users whose mutual friends and groups are counted in background
+SOCIAL_SCORING_LIMIT = 300
+
+# quantity of found users whose mutual friends and groups are counted at once (one friends.getMutual request)
+SOCIAL_BATCH_SIZE = 100
 
 
 class BotApi:
@@ -24,11 +62,22 @@ class BotApi:
                     used to send keyboards to bot user
         longpool:   class vk_api.longpoll.VkLongPoll object
                     used to perform bot permanent run
-        search_parameters:  attribute to store each bot users search parameters while they are prepared before sending
-                            to search method
-        select_dict:        attribute to save each bot users select results and position on watching through them
-        current_photos:     attribute to save each bot users current showing mate, needed to action with photos
+        dispatcher: class UserDispatcher object
+                    used to execute commands of different users concurrently
+        search_parameters:  state store (see state_store.py) to store each bot users search parameters while they are
+                            prepared before sending to search method
+        select_dict:        CandidateQueueStore to save each bot users CandidateQueue with ranked ids of select
+                            results, filled by background search while bot user watches through them, and to give
+                            found users from it
+        current_photos:     state store to save each bot users current showing mate, needed to action with photos
+        prefetcher:         class PersonPrefetcher object preparing found users which bot user will see next
+        pool:               class CandidatePool object, shares results of search in API between bot users with the
+                            same search parameters
+        view_counter:       class ViewCounter object writing views of found users to database in background
         interests:          attribute for class InterestsComparison object to call this class methods
+        scoring:            attribute for class BatchScoring object to evaluate all found users at once
+        sql_scoring_limit:  quantity of best matching cached found users evaluated by database at search start,
+                            0 if all cached found users are evaluated in Python
         apivk:              attribute for class VkontakteApi object to call this class methods
         db:                 attribute for class DB object to call this class methods
 
@@ -39,7 +88,13 @@ class BotApi:
         execute_age: executes different Age commands
         execute_city: executes different City commands
         execute_search: executes Search command
-        sort_found_user_by_match: sorts list of found users based on their likeness with bot user
+        search_in_background: searches people in API and pushes them to bot users queue in batches
+        read_cached_found_users: reads and evaluates found users already saved in database without API requests
+        add_social_scores: adds points for mutual friends and groups to found users in bot users queue
+        pop_person: takes next found user from bot users queue and reads data needed to show him
+        prepare_persons: reads data of found users and builds messages to show them
+        score_found_users: evaluates likeness of each found user with bot user
+        count_mutual_friends_and_groups: counts mutual friends and groups of bot user with each found user
         execute_next: executes Next command
         execute_like_photo: executes different photo like commands
         execute_delete_like_photo: executes different photo delete like commands command
@@ -56,27 +111,47 @@ class BotApi:
         send_age_keyboard: sends age choose keyboard to user
         send_city_keyboard: sends city choose keyboard to user
         send_next_keyboard: sends next keyboard to user
-        run_bot: creates/updates database and permanently runs bot to chat with users
+        prepare_database: creates/updates database and loads cities and genders cache
+        run_bot: prepares database, warms up interests comparison and permanently runs bot to chat with users
+        report_caches: prints interests normalization caches statistics with interval
+        handle_message: executes command from users message
     """
 
-    def __init__(self, user_token: str, bot_token: str, **info: dict) -> None:
+    def __init__(self, user_token: str, bot_token: str, http_settings: Optional[dict] = None,
+                 sql_scoring_limit: int = SQL_SCORING_LIMIT, state_settings: Optional[dict] = None,
+                 **info: dict) -> None:
         """
-        Sets attributes bot_token, bot_session, bot, longpool, search_parameters, select_dict, current_photos,
-        interests, apivk, db for object BotApi
+        Sets attributes bot_token, bot_session, bot, longpool, dispatcher, search_parameters, select_dict,
+        current_photos, prefetcher, pool, view_counter, interests, scoring, sql_scoring_limit, apivk, db for object
+        BotApi
         :param user_token: str, users token with necessary rights ('wall' rights are obligatory)
         :param bot_token: str, bot token of the community
+        :param http_settings: settings of HTTP session for VK API calls with users token
+        (pool_size, max_retries, backoff_factor, timeout, requests_per_second), defaults are used for absent ones
+        :param sql_scoring_limit: quantity of best matching cached found users evaluated by database,
+        0 if all cached found users are evaluated in Python
+        :param state_settings: settings of bot users state stores (backend 'memory' or 'postgres', max_size, ttl),
+        defaults are used for absent ones
         :param info: info for database connection
         """
         self.bot_token = bot_token
         self.bot_session = vk_api.VkApi(token=self.bot_token)
         self.bot = self.bot_session.get_api()
         self.longpool = VkLongPoll(self.bot_session)
-        self.search_parameters = dict()
-        self.select_dict = dict()
-        self.current_photos = dict()
-        self.interests = InterestsComparison()
-        self.apivk = VkontakteApi(user_token)
+        self.dispatcher = UserDispatcher(BOT_WORKERS)
         self.db = DB(**info)
+        state_settings = state_settings or {}
+        self.search_parameters = create_state_store('search_parameters', self.db, **state_settings)
+        self.select_dict = create_candidate_queue_store(self.db, **state_settings)
+        self.current_photos = create_state_store('current_photos', self.db, **state_settings)
+        self.prefetcher = PersonPrefetcher(self.prepare_persons)
+        self.pool = CandidatePool(self.db)
+        self.view_counter = ViewCounter(self.db)
+        self.interests = InterestsComparison()
+        self.scoring = BatchScoring(self.interests)
+        self.sql_scoring_limit = sql_scoring_limit
+        http_settings = {'requests_per_second': BOT_REQUESTS_PER_SECOND, **(http_settings or {})}
+        self.apivk = VkontakteApi(user_token, **http_settings)
 
     def execute_beginning(self, uid: int) -> bool:
         """
@@ -152,18 +227,20 @@ class BotApi:
         :param message_command: button age command (mask 'Возраст ...')
         :return:
         """
-        if uid in self.search_parameters and self.search_parameters[uid][2] is None:
+        search_info = self.search_parameters.get(uid)
+        if search_info is not None and search_info[2] is None:
 
             try:
                 age = int(message_command.split()[-1])
-                self.search_parameters[uid][2] = age
+                search_info[2] = age
+                self.search_parameters[uid] = search_info
                 return True
 
             except ValueError:
                 self.send_any_msg(uid, 'Неизвестная команда')
                 return False
 
-        elif uid in self.search_parameters:
+        elif search_info is not None:
             return False
 
         else:
@@ -182,16 +259,17 @@ class BotApi:
         :param message_command: button city command (mask 'г. ...')
         :return:
         """
-        if uid in self.search_parameters and self.search_parameters[uid][0] is None:
+        search_info = self.search_parameters.get(uid)
+        if search_info is not None and search_info[0] is None:
 
             city_title = message_command.split()[-1]
-            city_dict = {'москва': 1, 'санкт-петербург': 2, 'казань': 60, 'ростов-на-дону': 119, 'махачкала': 85,
-                         'екатеринбург': 49, 'новосибирск': 99, 'норильск': 102, 'владивосток': 37, 'якутск': 168}
+            city_dict = {title.lower(): city_id for title, city_id in kb.CITIES.items()}
             city_id = city_dict.get(city_title)
-            self.search_parameters[uid][0] = city_id
+            search_info[0] = city_id
+            self.search_parameters[uid] = search_info
             return True
 
-        elif uid in self.search_parameters:
+        elif search_info is not None:
             return False
 
         else:
@@ -206,10 +284,11 @@ class BotApi:
         If yes, sends him next keyboard, if no, checks whether search parameters for user are present.
         If no, sends him start keyboard, if yes, checks whether age and city present in search parameters.
         If yes, launches search, if no, sends user age/city/age-city keyboard.
-        When search in API is performed, users search parameters are cleared. For each found user top 3 photos are
-        searched and found user with photos is written to database
-        After it all corresponding to search parameters people are selected from database, written in select_dict and
-        first one is sent to bot user
+        When search is launched, users search parameters are cleared. Already present in database people corresponding
+        to search parameters are scored without API requests and put in users CandidateQueue in select_dict, their
+        mutual friends and groups are counted and search in API continues in background (see search_in_background).
+        First scored person is sent to bot user as soon as he is available, if he is not found during
+        FIRST_PERSON_TIMEOUT seconds, bot user is asked to go to next person later
         :param uid: user id
         :return:
         """
@@ -231,30 +310,33 @@ class BotApi:
             self.send_empty_keyboard(uid, 'Начинаю поиск')
             del(self.search_parameters[uid])
 
-            people_list = self.apivk.search_people(*search_info)
-            # people_list = self.apivk.search_many_people(*search_info)
-            # поиск с большим кол-вом результатов, при поиске фото по всем этим людям возможен таймаут
-            people_list = self.apivk.prepare_found_users_info(people_list)
-            for person in people_list:
-                self.db.write_found_user(person)
+            queue = CandidateQueue()
+            self.select_dict[uid] = queue
 
-            select_result = self.db.read_found_user(uid, search_info_dict)
+            cached_result, cached_scores = self.read_cached_found_users(uid, search_info_dict)
+            cached_ids = [found_user['id_user'] for found_user in cached_result]
+            if cached_result:
+                queue.push(cached_scores, cached_ids)
 
-            if not select_result:
-                self.send_any_msg(uid, 'В базе пока нет для вас пары. Возвращайтесь позже, база все время обновляется')
-                return False
+            threading.Thread(target=self.search_in_background,
+                             args=(uid, search_info, queue, cached_ids, cached_scores), daemon=True).start()
+
+            first_person = self.pop_person(uid, FIRST_PERSON_TIMEOUT)
 
-            select_result = self.sort_found_user_by_match(uid, select_result)
+            if not first_person and not self.select_dict.finished(uid):
+                self.current_photos[uid] = []
+                self.send_any_msg(uid, 'Поиск еще продолжается, попробуйте перейти к следующему пользователю позже')
+                self.send_next_keyboard(uid)
+                return False
 
-            self.select_dict[uid] = [0, select_result]
-            first_person = self.select_dict[uid][1][self.select_dict[uid][0]]
+            if not first_person:
+                del(self.select_dict[uid])
+                self.send_any_msg(uid, 'В базе пока нет для вас пары. Возвращайтесь позже, база все время обновляется')
+                return False
 
-            first_person_photos = self.db.query_photo(first_person['id_user'])
-            self.current_photos[uid] = first_person_photos
+            self.current_photos[uid] = first_person['photos']
 
-            self.send_person_msg(uid, first_person['id_user'],
-                                 first_person['first_name'], first_person['last_name'],
-                                 first_person_photos[0], first_person_photos[1], first_person_photos[2])
+            self.send_person_msg(uid, first_person)
 
             self.send_next_keyboard(uid)
 
@@ -272,93 +354,198 @@ class BotApi:
             self.send_city_keyboard(uid)
             return False
 
-    def sort_found_user_by_match(self, uid: int, found_users: list) -> list:
+    def search_in_background(self, uid: int, search_info: list, queue: CandidateQueue,
+                             cached_ids: Optional[list] = None, cached_scores=None) -> None:
+        """
+        Adds points for mutual friends and groups to best matching cached found users (see add_social_scores).
+        Then searches people in API and proceeds them in batches: for each found user top 3 photos are searched, found
+        users with photos are written to database in one transaction, then batch is selected from database (without
+        blacklisted people), scored and pushed to bot users queue, so bot user can watch already found people while
+        search continues.
+        API is not called if people with the same search parameters were searched recently (their cached results are
+        already in queue). If search with the same parameters is running for other bot user, waits for it and pushes
+        its results from database the same way as cached found users
+        :param uid: bot user id
+        :param search_info: list with search parameters: city id, gender id, age
+        :param queue: bot users CandidateQueue
+        :param cached_ids: ids of cached found users pushed to queue at search start
+        :param cached_scores: likeness indexes of cached found users without mutual friends and groups
+        :return:
         """
-        Sorts list of found users based on their likeness with bot user
+        search_info_dict = {'gender': search_info[1], 'city': search_info[0], 'age': search_info[2]}
+        try:
+            if cached_ids:
+                self.add_social_scores(uid, queue, cached_ids, cached_scores)
+
+            if self.pool.is_fresh(search_info_dict):
+                return
+
+            if not self.pool.begin_fetch(search_info_dict):
+                select_result = [found_user for found_user in self.db.read_found_user(uid, search_info_dict)
+                                 if found_user['id_user'] not in queue.ids]
+                if select_result:
+                    select_ids = [found_user['id_user'] for found_user in select_result]
+                    select_scores = self.scoring.score(self.db.read_user(uid)[0], select_result,
+                                                       self.interests.stop_words)
+                    queue.push(select_scores, select_ids)
+                    self.add_social_scores(uid, queue, select_ids, select_scores)
+                return
+
+            fetched = False
+            try:
+                people_list = self.apivk.search_people(*search_info)
+                # people_list = self.apivk.search_many_people(*search_info)
+                # поиск с большим кол-вом результатов, при поиске фото по всем этим людям возможен таймаут
+                people_list = [person for person in people_list if person['id'] not in queue.ids]
+
+                for i in range(0, len(people_list), SEARCH_BATCH_SIZE):
+                    batch = self.apivk.prepare_found_users_info(people_list[i:i + SEARCH_BATCH_SIZE])
+                    self.db.write_found_users_bulk(batch)
+
+                    select_result = self.db.read_found_user(uid, search_info_dict,
+                                                            ids=[person['id_user'] for person in batch])
+                    if select_result:
+                        queue.push(self.score_found_users(uid, select_result),
+                                   [found_user['id_user'] for found_user in select_result])
+                fetched = True
+            finally:
+                self.pool.end_fetch(search_info_dict, fetched)
+        finally:
+            queue.finish()
+
+    def read_cached_found_users(self, uid: int, search_info_dict: dict) -> tuple:
+        """
+        Reads found users matching search parameters already saved in database and evaluates their likeness with
+        bot user without mutual friends and groups, so no API requests are made before first found user is shown
+        (points for mutual friends and groups are added in background, see add_social_scores).
+        If sql_scoring_limit is set, likeness index is evaluated by database and only sql_scoring_limit best matching
+        found users are read
         :param uid: bot user id
-        :param found_users: list of found users
-        :return: sorted list of found users
+        :param search_info_dict: dict with search parameters: gender, city, age
+        :return: tuple of list of found users and numpy array with likeness index of each of them
         """
         user_dict = self.db.read_user(uid)[0]
+        if not self.sql_scoring_limit:
+            found_users = self.db.read_found_user(uid, search_info_dict)
+            return found_users, self.scoring.score(user_dict, found_users, self.interests.stop_words)
 
-        nltk.download('stopwords')  # line may be commented after first launch to avoid download warning in console
-        all_stopwords = stopwords.words("russian") + stopwords.words("english")
-        all_stopwords.extend(['всюду', 'очень', 'совместно', 'разный', 'самый', 'просто', 'наш', 'большой',
-                              'любой', 'далее', 'круто', 'личный', 'завтра', 'вокруг', 'возможно', 'именно',
-                              'помаленьку', 'многое', 'основное', 'это', 'всякий', 'поскольку', 'ещё', 'частенько',
-                              'бывший', 'рабочий', 'практически', 'вообще', 'ненадолго', 'свой', 'немного',
-                              'также', 'широкий', 'весь', 'хороший', 'каждый', 'внутренний', 'всё', 'пока',
-                              'круглогодично', 'твой'])  # words can be added if necessary
-
-        result = []
-        for found_user in found_users:
-            count = 0
+        found_users = self.db.read_top_found_users(uid, search_info_dict, user_dict, self.interests.stop_words,
+                                                   self.sql_scoring_limit)
+        return found_users, np.array([found_user['score'] for found_user in found_users], dtype=np.int64)
 
-            count += self.interests.compare_age(user_dict['age'], found_user['age'])
-            count += self.interests.compare_city(user_dict['city'], found_user['city'])
-
-            count += self.interests.evaluate_relations(found_user['relation'])
-            count += self.interests.compare_languages(user_dict['langs'], found_user['langs'])
-
-            count += self.interests.compare_interests_words(user_dict['activities'], found_user['activities'],
-                                                            all_stopwords, 2, 4, 6)
-            count += self.interests.compare_interests_words(user_dict['interests'], found_user['interests'],
-                                                            all_stopwords, 2, 4, 6)
-            count += self.interests.compare_interests_words(user_dict['inspired_by'], found_user['inspired_by'],
-                                                            all_stopwords, 1, 2, 3)
+    def add_social_scores(self, uid: int, queue: CandidateQueue, found_users_ids: list, scores) -> None:
+        """
+        Counts mutual friends and groups of bot user with SOCIAL_SCORING_LIMIT best matching found users, best ones
+        first, in batches of SOCIAL_BATCH_SIZE, and adds points for them to found users which are still in bot users
+        queue. Found users beyond limit keep likeness index without mutual friends and groups
+        :param uid: bot user id
+        :param queue: bot users CandidateQueue
+        :param found_users_ids: list of found users ids already pushed to queue
+        :param scores: likeness indexes of found users without mutual friends and groups
+        :return:
+        """
+        user_dict = self.db.read_user(uid)[0]
+        best_ids = [found_users_ids[i] for i in self.scoring.top_k(np.asarray(scores), SOCIAL_SCORING_LIMIT)]
+        for i in range(0, len(best_ids), SOCIAL_BATCH_SIZE):
+            batch_ids = best_ids[i:i + SOCIAL_BATCH_SIZE]
+            mutual_friends, mutual_groups = self.count_mutual_friends_and_groups(user_dict, batch_ids)
+            queue.add_scores(self.scoring.social_score(len(batch_ids), mutual_friends, mutual_groups), batch_ids)
+
+    def pop_person(self, uid: int, timeout: Optional[float] = None) -> Optional[dict]:
+        """
+        Takes id of next found user from bot users queue (with postgres state backend only saved cursor is moved, so
+        bot user continues from this place after restart or in other bot process), and takes found user prepared by
+        prefetcher (or prepares him if he is not prepared yet). Then starts preparing of found users which will be
+        shown next. Views of found user are counted in memory and written to
+        database in background, so most viewed found users are refreshed first
+        :param uid: bot user id
+        :param timeout: maximum seconds to wait for next found user, waits without limit if not passed
+        :return: dict with id_user, first_name, last_name, photos, message and attachment, None if queue gave no found
+        user
+        """
+        found_user_id = self.select_dict.pop(uid, timeout)
+        if found_user_id is None:
+            return None
+        self.view_counter.add(found_user_id)
 
-            count += self.interests.compare_interests_phrases(user_dict['music'], found_user['music'], 2, 3, 4)
-            count += self.interests.compare_interests_phrases(user_dict['movies'], found_user['movies'], 2, 3, 4)
-            count += self.interests.compare_interests_phrases(user_dict['tv'], found_user['tv'], 1, 2, 3)
-            count += self.interests.compare_interests_phrases(user_dict['books'], found_user['books'], 1, 2, 3)
-            count += self.interests.compare_interests_phrases(user_dict['games'], found_user['games'], 1, 2, 3)
+        person = self.prefetcher.take(uid, found_user_id) or self.prepare_persons([found_user_id])[0]
+        self.prefetcher.prefetch(uid, self.select_dict.peek(uid, PREFETCH_DEPTH))
+        return person
 
-            count += self.interests.compare_main_things(user_dict['political'], found_user['political'])
-            count += self.interests.compare_main_things(user_dict['religion_id'], found_user['religion_id'])
-            count += self.interests.compare_main_things(user_dict['life_main'], found_user['life_main'])
-            count += self.interests.compare_main_things(user_dict['people_main'], found_user['people_main'])
+    def prepare_persons(self, found_users_ids: list) -> list:
+        """
+        Reads from database only data needed to show found users and builds message and attachment to send them
+        :param found_users_ids: list of found users ids
+        :return: list of dicts with id_user, first_name, last_name, photos, message and attachment
+        """
+        persons = self.db.read_found_user_page(found_users_ids)
+        for person in persons:
+            person['message'] = f'''{person['first_name']} {person['last_name']}
+https://vk.com/id{person['id_user']}    
+        '''
+            person['attachment'] = ','.join(f'photo{photo}' for photo in person['photos'][:3])
+        return persons
 
-            count += self.interests.compare_smoking_alcohol(user_dict['smoking'], found_user['smoking'])
-            count += self.interests.compare_smoking_alcohol(user_dict['alcohol'], found_user['alcohol'])
+    def score_found_users(self, uid: int, found_users: list):
+        """
+        Evaluates likeness of each found user with bot user
+        :param uid: bot user id
+        :param found_users: list of found users
+        :return: numpy array with likeness index of each found user, in found_users order
+        """
+        user_dict = self.db.read_user(uid)[0]
+        mutual_friends, mutual_groups = self.count_mutual_friends_and_groups(
+            user_dict, [found_user['id_user'] for found_user in found_users])
 
-            mutual_friends = self.apivk.get_mutual_friends(user_dict['id_user'], found_user['id_user'])
-            count += self.interests.evaluate_mutual_friends(mutual_friends)
+        return self.scoring.score(user_dict, found_users, self.interests.stop_words, mutual_friends, mutual_groups)
 
-            mutual_groups = self.apivk.get_groups(user_dict['id_user']) & self.apivk.get_groups(found_user['id_user'])
-            count += self.interests.evaluate_mutual_groups(mutual_groups)
+    def count_mutual_friends_and_groups(self, user_dict: dict, found_users_ids: list) -> tuple:
+        """
+        Counts mutual friends and groups of bot user with each found user by batched API requests
+        :param user_dict: bot user dict read from database
+        :param found_users_ids: list of found users ids
+        :return: tuple of lists with quantities of mutual friends and mutual groups, in found_users_ids order
+        """
+        if not found_users_ids:
+            return [], []
 
-            result.append([count, found_user])
+        mutual_friends_dict = self.apivk.get_mutual_friends_batch(user_dict['id_user'], found_users_ids)
+        mutual_friends = [mutual_friends_dict[found_user_id] for found_user_id in found_users_ids]
 
-        result = sorted(result, key=lambda x: x[0], reverse=True)
+        user_groups = self.apivk.get_groups_cached(user_dict['id_user'])
+        found_users_groups = self.apivk.get_groups_batch(found_users_ids)
+        mutual_groups = [len(user_groups & found_users_groups[found_user_id]) for found_user_id in found_users_ids]
 
-        return [i[1] for i in result]
+        return mutual_friends, mutual_groups
 
     def execute_next(self, uid: int) -> bool:
         """
         Checks whether user has started work with bot or not.
-        If no, sends him start keyboard, if yes, switches counter in select_dict and sends to user next found person.
-        If next person is absent, clears select_dict and current_photos and sends to user keyboard with favourite
-        and start again buttons
+        If no, sends him start keyboard, if yes, takes next found person from users queue in select_dict and sends him
+        to user. If queue is empty while search continues, asks user to try later. If next person is absent and search
+        is finished, clears select_dict and current_photos and sends to user keyboard with favourite and start again
+        buttons
         :param uid: user id
         :return:
         """
         if uid in self.select_dict and uid in self.current_photos:
-            self.select_dict[uid][0] += 1
+            next_person = self.pop_person(uid, NEXT_PERSON_TIMEOUT)
 
-            if self.select_dict[uid][0] < len(self.select_dict[uid][1]):
-                next_person = self.select_dict[uid][1][self.select_dict[uid][0]]
-                next_person_photos = self.db.query_photo(next_person['id_user'])
-                self.current_photos[uid] = next_person_photos
+            if next_person:
+                self.current_photos[uid] = next_person['photos']
 
-                self.send_person_msg(uid, next_person['id_user'], next_person['first_name'], next_person['last_name'],
-                                     next_person_photos[0], next_person_photos[1], next_person_photos[2])
-                self.send_next_keyboard(uid)
+                self.send_person_msg(uid, next_person, kb.create_next_keyboard())
                 return True
 
+            elif not self.select_dict.finished(uid):
+                self.send_any_msg(uid, 'Поиск еще продолжается, попробуйте перейти к следующему пользователю позже')
+                return False
+
             else:
 
                 del(self.select_dict[uid])
                 del(self.current_photos[uid])
+                self.prefetcher.discard(uid)
                 self.send_favourite_start_keyboard(uid)
 
                 return False
@@ -379,6 +566,8 @@ class BotApi:
         """
         if uid in self.current_photos:
             three_photos = self.current_photos[uid]
+            if not three_photos:
+                return False
             photo = three_photos[photo_number-1]
             owner_id, photo_id = photo.split('_')
             self.apivk.like_photo(owner_id, photo_id)
@@ -401,6 +590,8 @@ class BotApi:
         """
         if uid in self.current_photos:
             three_photos = self.current_photos[uid]
+            if not three_photos:
+                return False
             photo = three_photos[photo_number - 1]
             owner_id, photo_id = photo.split('_')
             if self.apivk.check_like_presence(photo):
@@ -421,8 +612,10 @@ class BotApi:
         :return:
         """
         if uid in self.select_dict:
-            current_person = self.select_dict[uid][1][self.select_dict[uid][0]]
-            self.db.add_to_favourite(uid, current_person['id_user'])
+            current_person_id = self.select_dict.current(uid)
+            if current_person_id is None:
+                return False
+            self.db.add_to_favourite(uid, current_person_id)
             return True
 
         else:
@@ -459,9 +652,11 @@ class BotApi:
         :return:
         """
         if uid in self.select_dict:
-            current_person = self.select_dict[uid][1][self.select_dict[uid][0]]
-            self.db.add_to_blacklist(uid, current_person['id_user'])
-            self.db.delete_from_favourites(uid, current_person['id_user'])
+            current_person_id = self.select_dict.current(uid)
+            if current_person_id is None:
+                return False
+            self.db.add_to_blacklist(uid, current_person_id)
+            self.db.delete_from_favourites(uid, current_person_id)
             return True
 
         else:
@@ -480,25 +675,19 @@ class BotApi:
         self.bot_session.method('messages.send', {'user_id': uid, 'message': text, 'random_id': get_random_id()})
         return True
 
-    def send_person_msg(self, uid: int, person_id: int, name: str, surname: str,
-                        photo1: str, photo2: str, photo3: str) -> bool:
+    def send_person_msg(self, uid: int, person: dict, keyboard: Optional[str] = None) -> bool:
         """
         Sends user message with found users name, surname, link and three photos
         :param uid: user id
-        :param person_id: found user id to create link
-        :param name: users name
-        :param surname: user surname
-        :param photo1: users first photo id
-        :param photo2: users second photo id
-        :param photo3: users third photo id
+        :param person: found user dict with message and attachment prepared by prepare_persons
+        :param keyboard: keyboard json sent with message, keyboard is not changed if not passed
         :return:
         """
-        message = f'''{name} {surname}
-https://vk.com/id{person_id}    
-        '''
-        photo = f'photo{photo1},photo{photo2},photo{photo3}'
-        self.bot_session.method('messages.send', {'user_id': uid, 'message': message,
-                                                  'attachment': photo, 'random_id': get_random_id()})
+        values = {'user_id': uid, 'message': person['message'], 'attachment': person['attachment'],
+                  'random_id': get_random_id()}
+        if keyboard is not None:
+            values['keyboard'] = keyboard
+        self.bot_session.method('messages.send', values)
         return True
 
     def send_empty_keyboard(self, uid: int, message: str) -> bool:
@@ -595,9 +784,9 @@ https://vk.com/id{person_id}
 в черный список, посмотреть избранное или перейти к следующему пользователю''')
         return True
 
-    def run_bot(self):
+    def prepare_database(self) -> None:
         """
-        Creates database and/or tables and performs bot permanent work
+        Creates database and/or migrates tables, loads cities and genders cache
         :return:
         """
         engine = self.db.preparation()
@@ -609,45 +798,89 @@ https://vk.com/id{person_id}
             else:
                 print(test_new_db)
                 print('НИЧЕГО НЕ РАБОТАЕТ!')
+        self.db.warm_up_cache()
+
+    def run_bot(self, timings: Optional[dict] = None):
+        """
+        Prepares database and performs bot permanent work. Stop words and morphology dictionaries are loaded in
+        background thread while bot already answers, or before start if timings are passed.
+        Events of different users are handled concurrently by dispatcher, events of one user are handled in order
+        of arrival. Statistics of interests normalization caches are printed every CACHE_REPORT_INTERVAL seconds
+        :param timings: dict with already measured start phases, if passed, all start phases are done before
+        listening and their durations in seconds and caches statistics are printed
+        :return:
+        """
+        started = perf_counter()
+        self.prepare_database()
+        self.view_counter.start()
+        self.select_dict.start()
+
+        if timings is None:
+            threading.Thread(target=self.interests.warm_up, daemon=True).start()
+        else:
+            timings['database'] = perf_counter() - started
+            timings.update(self.interests.warm_up())
+            for phase, seconds in timings.items():
+                print(f'{phase}: {seconds:.3f} s')
+            print(self.interests.cache_report())
+        threading.Thread(target=self.report_caches, daemon=True).start()
 
         for event in self.longpool.listen():
             if event.type == VkEventType.MESSAGE_NEW:
                 if event.to_me:
-                    user_message = event.text.lower()
-                    user_id = event.user_id
-                    if user_message == 'начать':
-                        self.execute_beginning(user_id)
-                    elif user_message == 'help':
-                        self.execute_help(user_id)
-                    elif user_message == 'start':
-                        self.execute_start(user_id)
-                    elif user_message == 'search':
-                        self.execute_search(user_id)
-                    elif user_message == 'next':
-                        self.execute_next(user_id)
-                    elif user_message == 'лайк фото 1':
-                        self.execute_like_photo(user_id, 1)
-                    elif user_message == 'лайк фото 2':
-                        self.execute_like_photo(user_id, 2)
-                    elif user_message == 'лайк фото 3':
-                        self.execute_like_photo(user_id, 3)
-                    elif user_message == 'не лайк фото 1':
-                        self.execute_delete_like_photo(user_id, 1)
-                    elif user_message == 'не лайк фото 2':
-                        self.execute_delete_like_photo(user_id, 2)
-                    elif user_message == 'не лайк фото 3':
-                        self.execute_delete_like_photo(user_id, 3)
-                    elif user_message == 'в избранное':
-                        self.execute_add_to_favourite(user_id)
-                    elif user_message == 'посмотреть избранных':
-                        self.execute_show_favourite(user_id)
-                    elif user_message == 'в черный список':
-                        self.execute_add_to_blacklist(user_id)
-                    elif user_message.startswith('возраст'):
-                        self.execute_age(user_id, user_message)
-                    elif user_message.startswith('г.'):
-                        self.execute_city(user_id, user_message)
-                    else:
-                        self.bot_session.method('messages.send', {'user_id': user_id,
-                                                                  'message': 'Неизвестная команда',
-                                                                  'random_id': get_random_id()})
+                    self.dispatcher.submit(event.user_id, self.handle_message, event.user_id, event.text.lower())
+
+    def report_caches(self, interval: float = CACHE_REPORT_INTERVAL) -> None:
+        """
+        Prints statistics of interests normalization caches every interval seconds, so their hit rate under real load
+        can be checked
+        :param interval: seconds between reports
+        :return:
+        """
+        while True:
+            sleep(interval)
+            print(self.interests.cache_report())
+
+    def handle_message(self, user_id: int, user_message: str) -> None:
+        """
+        Executes bot users command
+        :param user_id: user id
+        :param user_message: lowercase message text
+        :return:
+        """
+        if user_message == 'начать':
+            self.execute_beginning(user_id)
+        elif user_message == 'help':
+            self.execute_help(user_id)
+        elif user_message == 'start':
+            self.execute_start(user_id)
+        elif user_message == 'search':
+            self.execute_search(user_id)
+        elif user_message == 'next':
+            self.execute_next(user_id)
+        elif user_message == 'лайк фото 1':
+            self.execute_like_photo(user_id, 1)
+        elif user_message == 'лайк фото 2':
+            self.execute_like_photo(user_id, 2)
+        elif user_message == 'лайк фото 3':
+            self.execute_like_photo(user_id, 3)
+        elif user_message == 'не лайк фото 1':
+            self.execute_delete_like_photo(user_id, 1)
+        elif user_message == 'не лайк фото 2':
+            self.execute_delete_like_photo(user_id, 2)
+        elif user_message == 'не лайк фото 3':
+            self.execute_delete_like_photo(user_id, 3)
+        elif user_message == 'в избранное':
+            self.execute_add_to_favourite(user_id)
+        elif user_message == 'посмотреть избранных':
+            self.execute_show_favourite(user_id)
+        elif user_message == 'в черный список':
+            self.execute_add_to_blacklist(user_id)
+        elif user_message.startswith('возраст'):
+            self.execute_age(user_id, user_message)
+        elif user_message.startswith('г.'):
+            self.execute_city(user_id, user_message)
+        else:
+            self.bot_session.method('messages.send', {'user_id': user_id,
+                                                      'message': 'Неизвестная команда',
+                                                      'random_id': get_random_id()})
@@ -1,12 +1,20 @@
 # -*- coding: utf-8 -*-
 
+from datetime import timedelta
+from typing import Optional
+
 import psycopg2
 import sqlalchemy
 from psycopg2 import Error
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from contextlib import contextmanager
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import sessionmaker
 
-from DB.models import User, FoundUser, City, Gender, BlackList, Favorites, Photo, create_tables
+from DB.models import User, FoundUser, City, Gender, BlackList, Favorites, Photo, BotState, SearchPool
+from DB.migrations import migrate
+from interests.batch_scoring import BatchScoring
+from interests.interests import InterestsComparison, WORDS_FIELDS, PHRASES_FIELDS
 
 connect_info = {'drivername': 'postgresql+psycopg2',
                 'username': 'postgres',
@@ -17,6 +25,10 @@ connect_info = {'drivername': 'postgresql+psycopg2',
                 }
 
 
+# connection pool settings which can be passed to DB together with connection info
+POOL_OPTIONS = ('pool_size', 'max_overflow', 'pool_timeout', 'pool_recycle', 'pool_pre_ping')
+
+
 # noinspection PyUnresolvedReferences
 class DB:
     """
@@ -29,9 +41,13 @@ class DB:
     __create_db()
     __close()
     preparation()
+    session_scope()
     create_table()
+    warm_up_cache()
     write_user()
     write_found_user()
+    write_found_users_bulk()
+    __found_user_row()
     __query_gender()
     __query_person()
     __query_city()
@@ -39,12 +55,29 @@ class DB:
     __add_gender()
     __add_city()
     query_photo()
+    query_found_user_ids()
+    read_stale_found_user_ids()
+    hide_found_users()
+    count_found_user_views()
+    read_found_user_page()
     read_user()
     read_found_user()
+    read_top_found_users()
+    __query_found_users()
+    __found_user_dict()
+    __score_expression()
+    __overlap_size()
     add_to_favourite()
     query_favourite()
     delete_from_favourites()
     add_to_blacklist()
+    read_state()
+    write_state()
+    delete_state()
+    delete_expired_states()
+    is_pool_fresh()
+    mark_pool_fetched()
+    __make_fingerprint()
     """
 
     def __init__(self, **info: dict):
@@ -58,12 +91,19 @@ class DB:
             host - where the database is located. For localhost location
             port - the connection port.
             database - the name of the database.
+            pool_size, max_overflow, pool_timeout, pool_recycle, pool_pre_ping - optional connection pool settings,
+            see sqlalchemy.create_engine.
             ---------------------------------------
         """
         self.connection = None
+        engine_options = {option: info.pop(option) for option in POOL_OPTIONS if option in info}
         self.info = info
+        self.interests = InterestsComparison()
         dsn = sqlalchemy.engine.url.URL.create(**info)
-        self.engine = sqlalchemy.create_engine(dsn)
+        self.engine = sqlalchemy.create_engine(dsn, **engine_options)
+        self.Session = sessionmaker(bind=self.engine, expire_on_commit=False)
+        self.cities = {}
+        self.genders = {}
 
     def new_database(self) -> (bool, psycopg2.Error):
         """
@@ -100,19 +140,50 @@ class DB:
     def preparation(self) -> sqlalchemy.engine.base.Engine:
         return self.engine
 
+    @contextmanager
+    def session_scope(self):
+        """
+        Provides session from the single session factory for a series of operations.
+        Session is committed if block is finished without errors, otherwise it is rolled back,
+        in both cases it is closed and connection is returned to pool
+        """
+        session = self.Session()
+        try:
+            yield session
+            session.commit()
+        except:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
     @staticmethod
     def create_table(engine: sqlalchemy.engine.base.Engine) -> bool:
         """
-        From the file models.py we get a function for
-        creating tables, with which we create the tables
-        specified in the file in the database models.py
+        From the file migrations.py we get a function for
+        creating tables and migrating existing ones, with which we bring
+        the database to the schema specified in the file models.py.
+        Data in existing tables are kept
         :param engine:  sqlalchemy.engine.base.Engine
         :return: was it possible to create tables
         """
         try:
-            res = create_tables(engine)
-            if res:
-                return True
+            migrate(engine)
+            return True
+        except:
+            return False
+
+    def warm_up_cache(self) -> bool:
+        """
+        Loads city and gender tables into process-local dictionaries, so existence of city and gender is checked
+        without database queries on each user and found user write
+        :return: was it possible to read tables
+        """
+        try:
+            with self.session_scope() as session:
+                self.cities = dict(session.query(City.id, City.city_title).all())
+                self.genders = dict(session.query(Gender.id, Gender.gender_title).all())
+            return True
         except:
             return False
 
@@ -138,53 +209,53 @@ class DB:
         if not g:
             self.__add_gender(id=person['gender'], gender_title=person['gender_title'])
         if not self.__query_user(person):
-            Session = sessionmaker(bind=self.engine)
-            session = Session()
-            if 'personal' in person and person['personal'] and person['personal'] is not None:
-                query = User(id=person['id'],
-                             first_name=person['first_name'],
-                             last_name=person['last_name'],
-                             middle_name=person['middle_name'],
-                             id_gender=person['gender'],
-                             id_city=person['city'],
-                             age=person['age'],
-                             activities=person['activities'],
-                             books=person['books'],
-                             games=person['games'],
-                             interests=person['interests'],
-                             movies=person['movies'],
-                             music=person['music'],
-                             political=person['personal'].get('political'),
-                             religion_id=person['personal'].get('religion_id'),
-                             life_main=person['personal'].get('life_main'),
-                             people_main=person['personal'].get('people_main'),
-                             smoking=person['personal'].get('smoking'),
-                             alcohol=person['personal'].get('alcohol'),
-                             inspired_by=person['personal'].get('inspired_by'),
-                             langs=person['personal'].get('langs'),
-                             relation=person['relation'],
-                             tv=person['tv']
-                             )
-            else:
-                query = User(id=person['id'],
-                             first_name=person['first_name'],
-                             last_name=person['last_name'],
-                             middle_name=person['middle_name'],
-                             id_gender=person['gender'],
-                             id_city=person['city'],
-                             age=person['age'],
-                             activities=person['activities'],
-                             books=person['books'],
-                             games=person['games'],
-                             interests=person['interests'],
-                             movies=person['movies'],
-                             music=person['music'],
-                             relation=person['relation'],
-                             tv=person['tv']
-                             )
-            session.add(query)
-            session.commit()
-            session.close()
+            fingerprint = self.__make_fingerprint(person)
+            with self.session_scope() as session:
+                if 'personal' in person and person['personal'] and person['personal'] is not None:
+                    query = User(id=person['id'],
+                                 first_name=person['first_name'],
+                                 last_name=person['last_name'],
+                                 middle_name=person['middle_name'],
+                                 id_gender=person['gender'],
+                                 id_city=person['city'],
+                                 age=person['age'],
+                                 activities=person['activities'],
+                                 books=person['books'],
+                                 games=person['games'],
+                                 interests=person['interests'],
+                                 movies=person['movies'],
+                                 music=person['music'],
+                                 political=person['personal'].get('political'),
+                                 religion_id=person['personal'].get('religion_id'),
+                                 life_main=person['personal'].get('life_main'),
+                                 people_main=person['personal'].get('people_main'),
+                                 smoking=person['personal'].get('smoking'),
+                                 alcohol=person['personal'].get('alcohol'),
+                                 inspired_by=person['personal'].get('inspired_by'),
+                                 langs=person['personal'].get('langs'),
+                                 relation=person['relation'],
+                                 tv=person['tv'],
+                                 **fingerprint
+                                 )
+                else:
+                    query = User(id=person['id'],
+                                 first_name=person['first_name'],
+                                 last_name=person['last_name'],
+                                 middle_name=person['middle_name'],
+                                 id_gender=person['gender'],
+                                 id_city=person['city'],
+                                 age=person['age'],
+                                 activities=person['activities'],
+                                 books=person['books'],
+                                 games=person['games'],
+                                 interests=person['interests'],
+                                 movies=person['movies'],
+                                 music=person['music'],
+                                 relation=person['relation'],
+                                 tv=person['tv'],
+                                 **fingerprint
+                                 )
+                session.add(query)
         return True
 
     def write_found_user(self, person: dict) -> bool:
@@ -214,88 +285,132 @@ class DB:
         if not g:
             self.__add_gender(id=person['gender'], gender_title=person['gender_title'])
         if not self.__query_person(person):
-            Session = sessionmaker(bind=self.engine)
-            session = Session()
-            if 'personal' in person and person['personal'] and person['personal'] is not None:
-                query = FoundUser(id=person['id_user'],
-                                  first_name=person['first_name'],
-                                  last_name=person['last_name'],
-                                  middle_name=person['middle_name'],
-                                  id_gender=person['gender'],
-                                  id_city=person['city'],
-                                  age=person['age'],
-                                  activities=person['activities'],
-                                  books=person['books'],
-                                  games=person['games'],
-                                  interests=person['interests'],
-                                  movies=person['movies'],
-                                  music=person['music'],
-                                  political=person['personal'].get('political'),
-                                  religion_id=person['personal'].get('religion_id'),
-                                  life_main=person['personal'].get('life_main'),
-                                  people_main=person['personal'].get('people_main'),
-                                  smoking=person['personal'].get('smoking'),
-                                  alcohol=person['personal'].get('alcohol'),
-                                  inspired_by=person['personal'].get('inspired_by'),
-                                  langs=person['personal'].get('langs'),
-                                  relation=person['relation'],
-                                  tv=person['tv'])
-            else:
-                query = FoundUser(id=person['id_user'],
-                                  first_name=person['first_name'],
-                                  last_name=person['last_name'],
-                                  middle_name=person['middle_name'],
-                                  id_gender=person['gender'],
-                                  id_city=person['city'],
-                                  age=person['age'],
-                                  activities=person['activities'],
-                                  books=person['books'],
-                                  games=person['games'],
-                                  interests=person['interests'],
-                                  movies=person['movies'],
-                                  music=person['music'],
-                                  relation=person['relation'],
-                                  tv=person['tv'])
-            session.add(query)
-            record_photo = []
-            for photo in person['photos']:
-                record_photo.append(Photo(id_photo=photo, id_found_user=person['id_user']))
-            session.add_all(record_photo)
-            session.commit()
-            session.close()
+            with self.session_scope() as session:
+                query = FoundUser(**self.__found_user_row(person))
+                session.add(query)
+                record_photo = []
+                for photo in person['photos']:
+                    record_photo.append(Photo(id_photo=photo, id_found_user=person['id_user']))
+                session.add_all(record_photo)
         return True
 
+    def write_found_users_bulk(self, persons: list) -> bool:
+        """
+        Writing to the database of several found users in one transaction.
+        Cities and genders are inserted if they are absent in cache, found users are inserted or, if they are already
+        present, their profile fields are refreshed (and they are shown again if they were hidden), photos of found
+        users are replaced with new ones.
+        Each table is written with one multi-row INSERT ... ON CONFLICT statement.
+        :param persons: list of dictionaries with data per person, same as for write_found_user
+        :return: true/false was the recording successful
+        """
+        if not persons:
+            return True
+
+        cities = {person['city']: {'id': person['city'], 'city_title': person['city_title']}
+                  for person in persons if person['city'] not in self.cities}
+        genders = {person['gender']: {'id': person['gender'], 'gender_title': person['gender_title']}
+                   for person in persons if person['gender'] not in self.genders}
+        found_users = {person['id_user']: person for person in persons}
+        found_user_rows = [self.__found_user_row(person) for person in found_users.values()]
+        photo_rows = [{'id_photo': photo, 'id_found_user': id_user}
+                      for id_user, person in found_users.items() for photo in person['photos']]
+
+        with self.session_scope() as session:
+            if cities:
+                session.execute(insert(City).values(list(cities.values()))
+                                .on_conflict_do_nothing(index_elements=['id']))
+            if genders:
+                session.execute(insert(Gender).values(list(genders.values()))
+                                .on_conflict_do_nothing(index_elements=['id']))
+
+            statement = insert(FoundUser).values(found_user_rows)
+            statement = statement.on_conflict_do_update(
+                index_elements=['id'],
+                set_={**{column: statement.excluded[column] for column in found_user_rows[0] if column != 'id'},
+                      'fetched_at': sqlalchemy.func.now(), 'hidden': False})
+            session.execute(statement)
+
+            session.execute(sqlalchemy.delete(Photo).where(Photo.id_found_user.in_(list(found_users))))
+            if photo_rows:
+                session.execute(insert(Photo).values(photo_rows))
+        self.cities.update((city['id'], city['city_title']) for city in cities.values())
+        self.genders.update((gender['id'], gender['gender_title']) for gender in genders.values())
+        return True
+
+    def __found_user_row(self, person: dict) -> dict:
+        """
+        Prepares founduser table row from found user data
+        :param person: dictionary with data per person, same as for write_found_user
+        :return: dict with column names as keys
+        """
+        personal = person.get('personal') or {}
+        return {'id': person['id_user'],
+                'first_name': person['first_name'],
+                'last_name': person['last_name'],
+                'middle_name': person['middle_name'],
+                'id_gender': person['gender'],
+                'id_city': person['city'],
+                'age': person['age'],
+                'activities': person['activities'],
+                'books': person['books'],
+                'games': person['games'],
+                'interests': person['interests'],
+                'movies': person['movies'],
+                'music': person['music'],
+                'political': personal.get('political'),
+                'religion_id': personal.get('religion_id'),
+                'life_main': personal.get('life_main'),
+                'people_main': personal.get('people_main'),
+                'smoking': personal.get('smoking'),
+                'alcohol': personal.get('alcohol'),
+                'inspired_by': personal.get('inspired_by'),
+                'langs': personal.get('langs'),
+                'relation': person['relation'],
+                'tv': person['tv'],
+                **self.__make_fingerprint(person)
+                }
+
+    def __make_fingerprint(self, person: dict) -> dict:
+        """
+        Prepares normalized token/phrase lists of persons text fields for '<field>_tokens' columns
+        :param person: dict with person data in write_user/write_found_user form
+        :return: dict with column names as keys and lists of tokens as values
+        """
+        personal = person.get('personal') or {}
+        text_fields = {field: person.get(field) for field in WORDS_FIELDS + PHRASES_FIELDS}
+        text_fields['inspired_by'] = personal.get('inspired_by')
+        return self.interests.make_fingerprint(text_fields, self.interests.stop_words)
+
     def __query_gender(self, gender: int) -> int:
-        Session = sessionmaker(bind=self.engine)
-        session = Session()
-        query = session.query(Gender).filter(Gender.id == gender).all()
-        session.close()
+        if gender in self.genders:
+            return gender
+        with self.session_scope() as session:
+            query = session.query(Gender).filter(Gender.id == gender).all()
         for q in query:
+            self.genders[q.id] = q.gender_title
             return q.id
 
     def __query_city(self, city: id) -> int:
-        Session = sessionmaker(bind=self.engine)
-        session = Session()
-        query = session.query(City).filter(City.id == city).all()
-        session.close()
+        if city in self.cities:
+            return city
+        with self.session_scope() as session:
+            query = session.query(City).filter(City.id == city).all()
         for q in query:
+            self.cities[q.id] = q.city_title
             return q.id
 
     def __query_person(self, person: dict) -> bool:
-        Session = sessionmaker(bind=self.engine)
-        session = Session()
-        query = session.query(FoundUser).filter(FoundUser.id == person['id_user']).all()
-        session.close()
+        with self.session_scope() as session:
+            query = session.query(FoundUser).filter(FoundUser.id == person['id_user']).all()
         if query:
             return True
         else:
             return False
 
     def __query_user(self, person):
-        Session = sessionmaker(bind=self.engine)
-        session = Session()
-        query = session.query(User).filter(User.id == person['id']).all()
-        session.close()
+        with self.session_scope() as session:
+            query = session.query(User).filter(User.id == person['id']).all()
         if query:
             return True
         else:
@@ -303,24 +418,20 @@ class DB:
 
     def __add_gender(self, **gender_info) -> bool:
         try:
-            Session = sessionmaker(bind=self.engine)
-            session = Session()
-            sex = Gender(**gender_info)
-            session.add(sex)
-            session.commit()
-            session.close()
+            with self.session_scope() as session:
+                sex = Gender(**gender_info)
+                session.add(sex)
+            self.genders[gender_info['id']] = gender_info.get('gender_title')
             return True
         except:
             return False
 
     def __add_city(self, **city_info) -> bool:
         try:
-            Session = sessionmaker(bind=self.engine)
-            session = Session()
-            c = City(**city_info)
-            session.add(c)
-            session.commit()
-            session.close()
+            with self.session_scope() as session:
+                c = City(**city_info)
+                session.add(c)
+            self.cities[city_info['id']] = city_info.get('city_title')
             return True
         except:
             return False
@@ -331,24 +442,95 @@ class DB:
         :param id_found_user:
         :return:
         """
-        Session = sessionmaker(bind=self.engine)
-        session = Session()
-        query = session.query(Photo.id_photo).filter(Photo.id_found_user == id_found_user).all()
-        session.close()
+        with self.session_scope() as session:
+            query = session.query(Photo.id_photo).filter(Photo.id_found_user == id_found_user).all()
         photos = []
         for q in query:
             photos.append(q[0])
         return photos
 
+    def query_found_user_ids(self, ids: list) -> set:
+        """
+        Getting ids of found users already saved in the database
+        :param ids: list of found users ids
+        :return: set of ids from the list which are in the founduser table
+        """
+        with self.session_scope() as session:
+            query = session.query(FoundUser.id).filter(FoundUser.id.in_(ids)).all()
+        return {q[0] for q in query}
+
+    def read_stale_found_user_ids(self, max_age: float, limit: int) -> list:
+        """
+        Getting ids of found users received from API more than max_age seconds ago, the most viewed by bot users
+        and then the longest not refreshed go first
+        :param max_age: seconds after receipt from API when found user is considered outdated
+        :param limit: maximum quantity of ids
+        :return: list of found users ids
+        """
+        stale_before = sqlalchemy.func.now() - timedelta(seconds=max_age)
+        with self.session_scope() as session:
+            query = session.query(FoundUser.id).filter(FoundUser.fetched_at < stale_before).order_by(
+                FoundUser.views.desc(), FoundUser.fetched_at).limit(limit).all()
+        return [q[0] for q in query]
+
+    def hide_found_users(self, ids: list) -> bool:
+        """
+        Marks found users whose profiles are closed, deleted or have less than 3 photos as hidden, they are not
+        searched until they are refreshed with open profile
+        :param ids: list of found users ids
+        :return: bool
+        """
+        if not ids:
+            return True
+        with self.session_scope() as session:
+            session.query(FoundUser).filter(FoundUser.id.in_(ids)).update(
+                {FoundUser.hidden: True, FoundUser.fetched_at: sqlalchemy.func.now()}, synchronize_session=False)
+        return True
+
+    def count_found_user_views(self, views: dict) -> bool:
+        """
+        Increases quantities of views of found users by bot users in one statement, most viewed found users are
+        refreshed first
+        :param views: dict with found user id as key and quantity of new views as value
+        :return: bool
+        """
+        if not views:
+            return True
+        with self.session_scope() as session:
+            session.query(FoundUser).filter(FoundUser.id.in_(list(views))).update(
+                {FoundUser.views: FoundUser.views + sqlalchemy.case(views, value=FoundUser.id, else_=0)},
+                synchronize_session=False)
+        return True
+
+    def read_found_user_page(self, ids: list) -> list:
+        """
+        Getting data needed to show found users: first name, last name, id and photos.
+        Only these columns are read, full profiles are not loaded
+        :param ids: list of found users ids
+        :return: list of dicts with keys id_user, first_name, last_name, photos in ids order,
+        absent found users are skipped
+        """
+        with self.session_scope() as session:
+            query = session.query(FoundUser.id, FoundUser.first_name, FoundUser.last_name).filter(
+                FoundUser.id.in_(ids)).all()
+            photos_query = session.query(Photo.id_found_user, Photo.id_photo).filter(
+                Photo.id_found_user.in_(ids)).order_by(Photo.id).all()
+
+        persons = {}
+        for q in query:
+            persons[q.id] = {'id_user': q.id, 'first_name': q.first_name, 'last_name': q.last_name, 'photos': []}
+        for q in photos_query:
+            persons[q.id_found_user]['photos'].append(q.id_photo)
+        return [persons[id_user] for id_user in ids if id_user in persons]
+
     def read_user(self, id_user: int):
         """
         Getting user data first name, last name, id
         :param id_user:
         :return:
         """
-        Session = sessionmaker(bind=self.engine)
-        session = Session()
-        query = session.query(User).filter(User.id == id_user).all()
+        with self.session_scope() as session:
+            query = session.query(User).filter(User.id == id_user).all()
         result = []
         if query:
             for q in query:
@@ -372,59 +554,160 @@ class DB:
                                'inspired_by': q.inspired_by,
                                'langs': q.langs,
                                'relation': q.relation,
-                               'tv': q.tv
+                               'tv': q.tv,
+                               **{f'{field}_tokens': getattr(q, f'{field}_tokens')
+                                  for field in WORDS_FIELDS + PHRASES_FIELDS}
                                })
         return result
 
-    def read_found_user(self, bot_user_id: int, requirement: dict) -> list:
+    def read_found_user(self, bot_user_id: int, requirement: dict, ids: Optional[list] = None) -> list:
         """
-        Search for a user in the database
+        Search for a user in the database, users blacklisted by bot user are excluded in the same query
         :param bot_user_id: int - id of the user who is looking for a mate
         :param requirement: dict
         'gender':int - id gender
         'city':int - id city
         'age':int - person age
+        :param ids: list - if passed, only found users with these ids are searched
         :return:
         """
-        Session = sessionmaker(bind=self.engine)
-        session = Session()
-        subquery = session.query(BlackList.id_found_user).filter(BlackList.id_user == bot_user_id).all()
-        subquery_list = []
-        for result in subquery:
-            subquery_list.append(result[0])
-
-        query = session.query(FoundUser).filter(FoundUser.id_gender == requirement['gender'],
-                                                FoundUser.id_city == requirement['city'],
-                                                FoundUser.age == requirement['age'],
-                                                FoundUser.id.not_in(subquery_list)).all()
+        with self.session_scope() as session:
+            query = self.__query_found_users(session, bot_user_id, requirement, ids).all()
 
-        session.close()
         result = []
         for q in query:
-            result.append({'first_name': q.first_name,
-                           'last_name': q.last_name,
-                           'id_user': q.id,
-                           'city': q.id_city,
-                           'age': q.age,
-                           'activities': q.activities,
-                           'books': q.books,
-                           'games': q.games,
-                           'interests': q.interests,
-                           'movies': q.movies,
-                           'music': q.music,
-                           'political': q.political,
-                           'religion_id': q.religion_id,
-                           'life_main': q.life_main,
-                           'people_main': q.people_main,
-                           'smoking': q.smoking,
-                           'alcohol': q.alcohol,
-                           'inspired_by': q.inspired_by,
-                           'langs': q.langs,
-                           'relation': q.relation,
-                           'tv': q.tv
-                           })
+            result.append(self.__found_user_dict(q))
         return result
 
+    def read_top_found_users(self, bot_user_id: int, requirement: dict, user: dict, stop_words,
+                             limit: int, ids: Optional[list] = None) -> list:
+        """
+        Search for a user in the database with likeness index evaluated by database, only found users with the
+        highest index are read. Index is evaluated with the same rules as BatchScoring.score without mutual friends
+        and groups, text fields are compared by '<field>_tokens' columns (found users without them get no points for
+        text fields)
+        :param bot_user_id: int - id of the user who is looking for a mate
+        :param requirement: dict, same as for read_found_user
+        :param user: dict - bot user data from read_user
+        :param stop_words: collection of common insignificant stop words to be deleted from bot users interests
+        :param limit: int - quantity of found users to read
+        :param ids: list - if passed, only found users with these ids are searched
+        :return: list of found users dicts with additional 'score' key, in descending score order
+        """
+        score = self.__score_expression(user, stop_words).label('score')
+        with self.session_scope() as session:
+            query = self.__query_found_users(session, bot_user_id, requirement, ids, score)
+            query = query.order_by(score.desc(), FoundUser.id).limit(limit).all()
+
+        result = []
+        for q, q_score in query:
+            result.append({**self.__found_user_dict(q), 'score': q_score})
+        return result
+
+    def __query_found_users(self, session, bot_user_id: int, requirement: dict, ids: Optional[list] = None,
+                            *columns):
+        blacklisted = session.query(BlackList.id).filter(BlackList.id_user == bot_user_id,
+                                                         BlackList.id_found_user == FoundUser.id).exists()
+
+        query = session.query(FoundUser, *columns).filter(FoundUser.id_gender == requirement['gender'],
+                                                          FoundUser.id_city == requirement['city'],
+                                                          FoundUser.age == requirement['age'],
+                                                          ~FoundUser.hidden,
+                                                          ~blacklisted)
+        if ids is not None:
+            query = query.filter(FoundUser.id.in_(ids))
+        return query
+
+    @staticmethod
+    def __found_user_dict(q: FoundUser) -> dict:
+        return {'first_name': q.first_name,
+                'last_name': q.last_name,
+                'id_user': q.id,
+                'city': q.id_city,
+                'age': q.age,
+                'activities': q.activities,
+                'books': q.books,
+                'games': q.games,
+                'interests': q.interests,
+                'movies': q.movies,
+                'music': q.music,
+                'political': q.political,
+                'religion_id': q.religion_id,
+                'life_main': q.life_main,
+                'people_main': q.people_main,
+                'smoking': q.smoking,
+                'alcohol': q.alcohol,
+                'inspired_by': q.inspired_by,
+                'langs': q.langs,
+                'relation': q.relation,
+                'tv': q.tv,
+                **{f'{field}_tokens': getattr(q, f'{field}_tokens') for field in WORDS_FIELDS + PHRASES_FIELDS}
+                }
+
+    def __score_expression(self, user: dict, stop_words):
+        """
+        Builds SQL expression of found users likeness index with bot user, see BatchScoring.score
+        :param user: dict - bot user data from read_user
+        :param stop_words: collection of common insignificant stop words to be deleted from bot users interests
+        :return: sqlalchemy expression
+        """
+        case = sqlalchemy.case
+        terms = [sqlalchemy.literal(0)]
+
+        if user['age']:
+            terms.append(case((FoundUser.age == user['age'], 13), else_=0))
+        if user['city']:
+            terms.append(case((FoundUser.id_city == user['city'], 13), else_=0))
+
+        terms.append(case((FoundUser.relation.in_([1, 6]), 5),
+                          (FoundUser.relation == 0, 2),
+                          (FoundUser.relation.in_([2, 3, 4, 7, 8]), -5),
+                          else_=0))
+
+        if user['langs']:
+            languages = self.__overlap_size(
+                sqlalchemy.func.string_to_array(sqlalchemy.func.left(sqlalchemy.func.right(FoundUser.langs, -1), -1),
+                                                ','),
+                set(user['langs'][1:-1].split(',')))
+            # simple CASE over least() evaluates overlap subquery once instead of once per condition
+            terms.append(case({2: 1, 3: 2, 4: 3, 5: 4}, value=sqlalchemy.func.least(languages, 5), else_=0))
+
+        user_tokens = self.interests.get_fingerprint(user, stop_words)
+        for field in WORDS_FIELDS + PHRASES_FIELDS:
+            if not user_tokens[field]:
+                continue
+            res1, res2, res3 = BatchScoring.text_weights[field]
+            size = self.__overlap_size(getattr(FoundUser, f'{field}_tokens'), user_tokens[field])
+            terms.append(case({1: res1, **{n: res2 for n in range(2, 7)}, 7: res3},
+                              value=sqlalchemy.func.least(size, 7), else_=0))
+
+        for field in ('political', 'religion_id', 'life_main', 'people_main'):
+            if user[field]:
+                terms.append(case((getattr(FoundUser, field) == user[field], 2), else_=0))
+
+        for field in ('smoking', 'alcohol'):
+            if user[field]:
+                addict = sqlalchemy.func.coalesce(getattr(FoundUser, field), 0)
+                difference = sqlalchemy.func.abs(addict - int(user[field]))
+                terms.append(case((addict == 0, 0), (difference == 0, 2), (difference == 3, -1), (difference == 4, -2),
+                                  else_=0))
+
+        return sum(terms[1:], terms[0])
+
+    @staticmethod
+    def __overlap_size(column, values: set):
+        """
+        Builds SQL expression of quantity of distinct elements of array column present in values
+        :param column: sqlalchemy expression of text array
+        :param values: set of strings
+        :return: sqlalchemy scalar subquery
+        """
+        elements = sqlalchemy.func.unnest(column).table_valued('element')
+        values = sqlalchemy.literal(sorted(values), type_=sqlalchemy.ARRAY(sqlalchemy.Text))
+        return (sqlalchemy.select(sqlalchemy.func.count(sqlalchemy.distinct(elements.c.element)))
+                .where(elements.c.element == sqlalchemy.any_(values))
+                .scalar_subquery())
+
     def add_to_favourite(self, id_user: int, id_found_user: int) -> bool:
         """
         add the found user to the favorites list
@@ -435,13 +718,10 @@ class DB:
         :return: bool
         """
         try:
-            Session = sessionmaker(bind=self.engine)
-            session = Session()
-            id_record = f'{id_user}_{id_found_user}'
-            fav = Favorites(id=id_record, id_user=id_user, id_found_user=id_found_user)
-            session.add(fav)
-            session.commit()
-            session.close()
+            with self.session_scope() as session:
+                id_record = f'{id_user}_{id_found_user}'
+                fav = Favorites(id=id_record, id_user=id_user, id_found_user=id_found_user)
+                session.add(fav)
             return True
         except:
             return False
@@ -452,12 +732,10 @@ class DB:
         :param user_id: int
         :return: list
         """
-        Session = sessionmaker(bind=self.engine)
-        session = Session()
-        subquery = session.query(Favorites.id_found_user).filter(Favorites.id_user == user_id).all()
-        subquery_list = [i[0] for i in subquery]
-        query = session.query(FoundUser).filter(FoundUser.id.in_(subquery_list)).all()
-        session.close()
+        with self.session_scope() as session:
+            subquery = session.query(Favorites.id_found_user).filter(Favorites.id_user == user_id).all()
+            subquery_list = [i[0] for i in subquery]
+            query = session.query(FoundUser).filter(FoundUser.id.in_(subquery_list)).all()
         return query
 
     def delete_from_favourites(self, id_user, id_found_user):
@@ -469,14 +747,11 @@ class DB:
         :param id_found_user: int
         :return: bool
         """
-        Session = sessionmaker(bind=self.engine)
-        session = Session()
-        favourite = session.query(Favorites).filter(Favorites.id_user == id_user,
-                                                    Favorites.id_found_user == id_found_user).all()
-        if favourite:
-            session.delete(favourite[0])
-            session.commit()
-            session.close()
+        with self.session_scope() as session:
+            favourite = session.query(Favorites).filter(Favorites.id_user == id_user,
+                                                        Favorites.id_found_user == id_found_user).all()
+            if favourite:
+                session.delete(favourite[0])
 
     def add_to_blacklist(self, id_user, id_found_user) -> bool:
         """
@@ -488,17 +763,115 @@ class DB:
         :return: bool
         """
         try:
-            Session = sessionmaker(bind=self.engine)
-            session = Session()
-            id_record = f'{id_user}_{id_found_user}'
-            bl = BlackList(id=id_record, id_user=id_user, id_found_user=id_found_user)
-            session.add(bl)
-            session.commit()
-            session.close()
+            with self.session_scope() as session:
+                id_record = f'{id_user}_{id_found_user}'
+                bl = BlackList(id=id_record, id_user=id_user, id_found_user=id_found_user)
+                session.add(bl)
             return True
         except:
             return False
 
+    def read_state(self, id_state: str):
+        """
+        Getting not expired bot user state
+        :param id_state: str - state id in form namespace_iduser
+        :return: state value, None if state is absent or expired
+        """
+        with self.session_scope() as session:
+            query = session.query(BotState.value).filter(BotState.id == id_state,
+                                                         BotState.expires_at > sqlalchemy.func.now()).all()
+        for q in query:
+            return q[0]
+
+    def write_state(self, id_state: str, value, ttl: float) -> bool:
+        """
+        Writing or replacing bot user state
+        :param id_state: str - state id in form namespace_iduser
+        :param value: JSON serializable state value
+        :param ttl: seconds after which state expires
+        :return: bool
+        """
+        statement = insert(BotState).values(id=id_state, value=value,
+                                            expires_at=sqlalchemy.func.now() + timedelta(seconds=ttl))
+        statement = statement.on_conflict_do_update(index_elements=['id'],
+                                                    set_={'value': statement.excluded.value,
+                                                          'expires_at': statement.excluded.expires_at})
+        with self.session_scope() as session:
+            session.execute(statement)
+        return True
+
+    def compare_and_set_state(self, id_state: str, value, expected: dict, ttl: float) -> bool:
+        """
+        Replacing bot user state only if it is not expired and its fields are equal to expected ones, so concurrent
+        changes of state by other threads or bot processes are not lost
+        :param id_state: str - state id in form namespace_iduser
+        :param value: JSON serializable state value
+        :param expected: dict with state field as key and its expected not None value as value
+        :param ttl: seconds after which state expires
+        :return: bool - True if state was replaced
+        """
+        conditions = [BotState.value[field].as_string() == str(expected_value)
+                      for field, expected_value in expected.items()]
+        with self.session_scope() as session:
+            updated = session.query(BotState).filter(
+                BotState.id == id_state, BotState.expires_at > sqlalchemy.func.now(), *conditions).update(
+                {'value': value, 'expires_at': sqlalchemy.func.now() + timedelta(seconds=ttl)},
+                synchronize_session=False)
+        return updated == 1
+
+    def delete_state(self, id_state: str) -> bool:
+        """
+        Deleting bot user state
+        :param id_state: str - state id in form namespace_iduser
+        :return: bool
+        """
+        with self.session_scope() as session:
+            session.query(BotState).filter(BotState.id == id_state).delete()
+        return True
+
+    def delete_expired_states(self) -> int:
+        """
+        Deleting expired states of all bot users
+        :return: int - quantity of deleted states
+        """
+        with self.session_scope() as session:
+            deleted = session.query(BotState).filter(BotState.expires_at <= sqlalchemy.func.now()).delete(
+                synchronize_session=False)
+        return deleted
+
+    def is_pool_fresh(self, requirement: dict, max_age: float) -> bool:
+        """
+        Checks whether people with search parameters were searched in API recently
+        :param requirement: dict
+        'gender':int - id gender
+        'city':int - id city
+        'age':int - person age
+        :param max_age: seconds after search when its results are considered outdated
+        :return: bool
+        """
+        id_record = f"{requirement['city']}_{requirement['gender']}_{requirement['age']}"
+        with self.session_scope() as session:
+            query = session.query(SearchPool.id).filter(
+                SearchPool.id == id_record,
+                SearchPool.fetched_at > sqlalchemy.func.now() - timedelta(seconds=max_age)).all()
+        return bool(query)
+
+    def mark_pool_fetched(self, requirement: dict) -> bool:
+        """
+        Saves time of search in API of people with search parameters
+        :param requirement: dict, same as for is_pool_fresh
+        :return: bool
+        """
+        id_record = f"{requirement['city']}_{requirement['gender']}_{requirement['age']}"
+        statement = insert(SearchPool).values(id=id_record, id_city=requirement['city'],
+                                              id_gender=requirement['gender'], age=requirement['age'],
+                                              fetched_at=sqlalchemy.func.now())
+        statement = statement.on_conflict_do_update(index_elements=['id'],
+                                                    set_={'fetched_at': statement.excluded.fetched_at})
+        with self.session_scope() as session:
+            session.execute(statement)
+        return True
+
 
 def main():
     work = DB(**connect_info)
@@ -0,0 +1,95 @@
+import sqlalchemy as sq
+
+from DB.models import Base, BotState, SchemaVersion, SearchPool, create_indexes
+from interests.interests import WORDS_FIELDS, PHRASES_FIELDS
+
+# key of PostgreSQL advisory lock, so schema is migrated by one bot process at a time
+MIGRATION_LOCK_KEY = 20221121
+
+
+def create_all_tables(connection) -> None:
+    """
+    Creates tables which are absent in database, existing tables and their data are kept
+    :param connection: sqlalchemy.engine.Connection
+    :return:
+    """
+    Base.metadata.create_all(connection)
+
+
+def add_tokens_columns(connection) -> None:
+    """
+    Adds columns with normalized tokens of text fields to user and founduser tables created before them
+    :param connection: sqlalchemy.engine.Connection
+    :return:
+    """
+    for table in ('user', 'founduser'):
+        for field in WORDS_FIELDS + PHRASES_FIELDS:
+            connection.execute(sq.text(f'ALTER TABLE "{table}" ADD COLUMN IF NOT EXISTS {field}_tokens TEXT[]'))
+
+
+def create_bot_state_table(connection) -> None:
+    """
+    Creates table for bot users state
+    :param connection: sqlalchemy.engine.Connection
+    :return:
+    """
+    BotState.__table__.create(connection, checkfirst=True)
+
+
+def create_search_pool_table(connection) -> None:
+    """
+    Creates table with time of last search in API for each search parameters
+    :param connection: sqlalchemy.engine.Connection
+    :return:
+    """
+    SearchPool.__table__.create(connection, checkfirst=True)
+
+
+def add_refresh_columns(connection) -> None:
+    """
+    Adds to founduser and photo tables created before them columns with time of receipt from API, views quantity and
+    hidden flag, and index on time of receipt. Already saved found users and photos get the earliest time, so they
+    are refreshed first
+    :param connection: sqlalchemy.engine.Connection
+    :return:
+    """
+    for table in ('founduser', 'photo'):
+        connection.execute(sq.text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS fetched_at TIMESTAMP NOT NULL "
+                                   f"DEFAULT 'epoch'"))
+        connection.execute(sq.text(f'ALTER TABLE {table} ALTER COLUMN fetched_at SET DEFAULT now()'))
+    connection.execute(sq.text('ALTER TABLE founduser ADD COLUMN IF NOT EXISTS views INTEGER NOT NULL DEFAULT 0'))
+    connection.execute(sq.text('ALTER TABLE founduser ADD COLUMN IF NOT EXISTS hidden BOOLEAN NOT NULL DEFAULT false'))
+    connection.execute(sq.text('CREATE INDEX IF NOT EXISTS ix_founduser_fetched_at ON founduser (fetched_at)'))
+
+
+# schema migrations (version, description, function), applied in order, each version is applied once.
+# Migration must not delete data and must work both on new database and on database created by older version
+MIGRATIONS = [
+    (1, 'create tables', create_all_tables),
+    (2, 'add normalized tokens columns', add_tokens_columns),
+    (3, 'add search and foreign key indexes', create_indexes),
+    (4, 'create bot state table', create_bot_state_table),
+    (5, 'create search pool table', create_search_pool_table),
+    (6, 'add found users refresh columns', add_refresh_columns),
+]
+
+
+def migrate(engine: sq.engine.Engine) -> list:
+    """
+    Brings database schema to the latest version. Tables are created if absent, migrations which are not yet
+    recorded in schema_version table are applied in one transaction, data in existing tables are kept
+    :param engine: sqlalchemy.engine.base.Engine
+    :return: list of applied migrations versions, empty if schema is up to date
+    """
+    applied = []
+    with engine.begin() as connection:
+        connection.execute(sq.select(sq.func.pg_advisory_xact_lock(MIGRATION_LOCK_KEY)))
+        SchemaVersion.__table__.create(connection, checkfirst=True)
+        current = connection.execute(sq.select(sq.func.max(SchemaVersion.version))).scalar() or 0
+        for version, description, function in MIGRATIONS:
+            if version <= current:
+                continue
+            function(connection)
+            connection.execute(sq.insert(SchemaVersion).values(version=version, description=description))
+            applied.append(version)
+    return applied
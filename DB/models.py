@@ -30,6 +30,15 @@ class User(Base):
     langs = sq.Column(sq.Text, nullable=True)
     relation = sq.Column(sq.Integer, nullable=True)
     tv = sq.Column(sq.Text, nullable=True)
+    # normalized token/phrase sets of text fields, prepared once on write to avoid parsing on each search
+    activities_tokens = sq.Column(sq.ARRAY(sq.Text), nullable=True)
+    interests_tokens = sq.Column(sq.ARRAY(sq.Text), nullable=True)
+    inspired_by_tokens = sq.Column(sq.ARRAY(sq.Text), nullable=True)
+    music_tokens = sq.Column(sq.ARRAY(sq.Text), nullable=True)
+    movies_tokens = sq.Column(sq.ARRAY(sq.Text), nullable=True)
+    tv_tokens = sq.Column(sq.ARRAY(sq.Text), nullable=True)
+    books_tokens = sq.Column(sq.ARRAY(sq.Text), nullable=True)
+    games_tokens = sq.Column(sq.ARRAY(sq.Text), nullable=True)
     city = relationship("City", backref='user')
     gender = relationship('Gender', backref='user')
     hobby = relationship('Hobby', backref='user')
@@ -39,6 +48,8 @@ class User(Base):
 
 class FoundUser(Base):
     __tablename__ = 'founduser'
+    # found users are searched by gender, city and age (see DB.read_found_user)
+    __table_args__ = (sq.Index('ix_founduser_gender_city_age', 'id_gender', 'id_city', 'age'),)
 
     id = sq.Column(sq.Integer, primary_key=True, unique=True)
     last_name = sq.Column(sq.Text, nullable=False)
@@ -63,6 +74,21 @@ class FoundUser(Base):
     langs = sq.Column(sq.Text, nullable=True)
     relation = sq.Column(sq.Integer, nullable=True)
     tv = sq.Column(sq.Text, nullable=True)
+    # normalized token/phrase sets of text fields, prepared once on write to avoid parsing on each search
+    activities_tokens = sq.Column(sq.ARRAY(sq.Text), nullable=True)
+    interests_tokens = sq.Column(sq.ARRAY(sq.Text), nullable=True)
+    inspired_by_tokens = sq.Column(sq.ARRAY(sq.Text), nullable=True)
+    music_tokens = sq.Column(sq.ARRAY(sq.Text), nullable=True)
+    movies_tokens = sq.Column(sq.ARRAY(sq.Text), nullable=True)
+    tv_tokens = sq.Column(sq.ARRAY(sq.Text), nullable=True)
+    books_tokens = sq.Column(sq.ARRAY(sq.Text), nullable=True)
+    games_tokens = sq.Column(sq.ARRAY(sq.Text), nullable=True)
+    # время последнего получения профиля из API
+    fetched_at = sq.Column(sq.DateTime, nullable=False, server_default=sq.func.now(), index=True)
+    # количество показов пользователям бота
+    views = sq.Column(sq.Integer, nullable=False, server_default='0')
+    # профиль закрыт, удален или в нем меньше 3 фотографий, такой пользователь не выдается в поиске
+    hidden = sq.Column(sq.Boolean, nullable=False, server_default=sq.false())
     city = relationship('City', backref='founduser')
     gender = relationship('Gender', backref='founduser')
     hobby = relationship('Hobby', backref='founduser')
@@ -71,6 +97,15 @@ class FoundUser(Base):
     photo = relationship('Photo', backref='founduser')
 
 
+class SchemaVersion(Base):
+    __tablename__ = 'schema_version'
+
+    # номер примененной миграции из DB/migrations.py
+    version = sq.Column(sq.Integer, primary_key=True, autoincrement=False)
+    description = sq.Column(sq.Text, nullable=False)
+    applied_at = sq.Column(sq.DateTime, nullable=False, server_default=sq.func.now())
+
+
 class City(Base):
     __tablename__ = 'city'
 
@@ -102,8 +137,8 @@ class BlackList(Base):
 
     # id выглядит как idпользователя_idнайденнойперсоны
     id = sq.Column(sq.Text, primary_key=True, unique=True)
-    id_user = sq.Column(sq.Integer, sq.ForeignKey('user.id'), nullable=True)
-    id_found_user = sq.Column(sq.Integer, sq.ForeignKey('founduser.id'), nullable=True)
+    id_user = sq.Column(sq.Integer, sq.ForeignKey('user.id'), nullable=True, index=True)
+    id_found_user = sq.Column(sq.Integer, sq.ForeignKey('founduser.id'), nullable=True, index=True)
 
 
 class Favorites(Base):
@@ -111,8 +146,8 @@ class Favorites(Base):
 
     # id выглядит как idпользователя_idнайденнойперсоны
     id = sq.Column(sq.Text, primary_key=True, unique=True)
-    id_user = sq.Column(sq.Integer, sq.ForeignKey('user.id'), nullable=True)
-    id_found_user = sq.Column(sq.Integer, sq.ForeignKey('founduser.id'), nullable=True)
+    id_user = sq.Column(sq.Integer, sq.ForeignKey('user.id'), nullable=True, index=True)
+    id_found_user = sq.Column(sq.Integer, sq.ForeignKey('founduser.id'), nullable=True, index=True)
 
 
 class Photo(Base):
@@ -120,13 +155,50 @@ class Photo(Base):
 
     id = sq.Column(sq.Integer, primary_key=True, unique=True, autoincrement=True)
     id_photo = sq.Column(sq.Text, nullable=False)
-    id_found_user = sq.Column(sq.Integer, sq.ForeignKey('founduser.id'), nullable=True)
+    id_found_user = sq.Column(sq.Integer, sq.ForeignKey('founduser.id'), nullable=True, index=True)
+    # время получения фотографии из API
+    fetched_at = sq.Column(sq.DateTime, nullable=False, server_default=sq.func.now())
 
 
-def create_tables(engine):
-    try:
-        Base.metadata.drop_all(engine)
-        Base.metadata.create_all(engine)
-        return True
-    except:
-        return False
+class BotState(Base):
+    __tablename__ = 'botstate'
+
+    # id выглядит как видсостояния_idпользователя
+    id = sq.Column(sq.Text, primary_key=True, unique=True)
+    value = sq.Column(sq.JSON, nullable=False)
+    expires_at = sq.Column(sq.DateTime, nullable=False, index=True)
+
+
+class SearchPool(Base):
+    __tablename__ = 'searchpool'
+
+    # id выглядит как idгорода_idпола_возраст
+    id = sq.Column(sq.Text, primary_key=True, unique=True)
+    id_city = sq.Column(sq.Integer, nullable=False)
+    id_gender = sq.Column(sq.Integer, nullable=False)
+    age = sq.Column(sq.Integer, nullable=False)
+    # время последнего поиска в API людей с этими параметрами
+    fetched_at = sq.Column(sq.DateTime, nullable=False)
+
+
+def create_indexes(engine):
+    """
+    Creates indexes declared in models which are absent in database. create_all does not add indexes to already
+    existing tables, so this function is used to add new indexes to existing database. Indexes on columns which are
+    absent in database are skipped, they are created by migration adding these columns
+    :param engine: sqlalchemy.engine.base.Engine or Connection
+    :return: list of names of created indexes
+    """
+    inspector = sq.inspect(engine)
+    tables = set(inspector.get_table_names())
+    created = []
+    for table in Base.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for index in table.indexes:
+            if index.name not in existing and all(column.name in columns for column in index.columns):
+                index.create(engine)
+                created.append(index.name)
+    return created
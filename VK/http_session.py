@@ -0,0 +1,59 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from vk_api.vk_api import DEFAULT_USERAGENT
+
+# default settings of HTTP session used for VK API calls
+HTTP_POOL_SIZE = 10
+HTTP_MAX_RETRIES = 3
+HTTP_BACKOFF_FACTOR = 0.5
+HTTP_TIMEOUT = 10
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter which sets default timeout for requests sent without explicit timeout
+    (vk_api sends requests without timeout)
+
+    Attributes:
+        timeout: seconds to wait for connection and response
+    """
+
+    def __init__(self, *args, timeout: float = HTTP_TIMEOUT, **kwargs) -> None:
+        """
+        Sets attribute timeout, other arguments are passed to requests.adapters.HTTPAdapter
+        :param timeout: seconds to wait for connection and response
+        """
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        """
+        Sends request with default timeout if timeout is not passed, see requests.adapters.HTTPAdapter.send
+        """
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def create_session(pool_size: int = HTTP_POOL_SIZE, max_retries: int = HTTP_MAX_RETRIES,
+                   backoff_factor: float = HTTP_BACKOFF_FACTOR, timeout: float = HTTP_TIMEOUT) -> requests.Session:
+    """
+    Creates HTTP session with keep-alive connections pool, retries with backoff on 5xx responses, connection errors
+    and timeouts, and default timeout for each request
+    :param pool_size: quantity of kept open connections to one host
+    :param max_retries: quantity of retries of failed request
+    :param backoff_factor: delay between retries is backoff_factor * 2 ** (retry number - 1) seconds
+    :param timeout: seconds to wait for connection and response
+    :return: requests.Session object
+    """
+    retries = Retry(total=max_retries, backoff_factor=backoff_factor, status_forcelist=(500, 502, 503, 504),
+                    allowed_methods=frozenset(['GET', 'POST']), raise_on_status=False)
+    adapter = TimeoutHTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries,
+                                 timeout=timeout)
+
+    session = requests.Session()
+    session.headers['User-agent'] = DEFAULT_USERAGENT
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
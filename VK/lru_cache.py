@@ -0,0 +1,48 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Thread-safe bounded cache, when it is full least recently used entry is evicted
+
+    Attributes:
+        max_size:   maximum quantity of kept entries
+        items:      OrderedDict with cached entries, least recently used first
+        lock:       threading.Lock object protecting items
+
+    Methods:
+        get: returns entry and marks it as recently used, default if it is absent
+    """
+
+    def __init__(self, max_size: int) -> None:
+        """
+        Sets attributes max_size, items and lock for object LRUCache
+        :param max_size: maximum quantity of kept entries
+        """
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Returns entry and marks it as recently used
+        :param key: entry key
+        :param default: value returned if entry is absent
+        :return: entry
+        """
+        with self.lock:
+            if key not in self.items:
+                return default
+            self.items.move_to_end(key)
+            return self.items[key]
+
+    def __setitem__(self, key, value) -> None:
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self.items)
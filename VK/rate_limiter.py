@@ -0,0 +1,78 @@
+import threading
+from contextlib import nullcontext
+from time import monotonic, sleep
+
+import vk_api
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter
+
+    Attributes:
+        rate:       tokens added to bucket per second (allowed requests per second)
+        capacity:   maximum quantity of tokens in bucket (allowed burst of requests)
+        tokens:     current quantity of tokens in bucket
+        updated:    time of last tokens quantity update
+        lock:       threading.Lock object to share bucket between threads
+
+    Methods:
+        acquire: takes token from bucket, waits until token is available
+    """
+
+    def __init__(self, rate: float, capacity: float = 1) -> None:
+        """
+        Sets attributes rate, capacity, tokens, updated and lock for object TokenBucket
+        :param rate: allowed requests per second
+        :param capacity: allowed burst of requests, 1 means requests are evenly spread in time
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1) -> None:
+        """
+        Takes tokens from bucket, if they are absent waits until they are added
+        :param tokens: quantity of tokens to take
+        :return:
+        """
+        while True:
+            with self.lock:
+                now = monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                delay = (tokens - self.tokens) / self.rate
+            sleep(delay)
+
+
+class RateLimitedVkApi(vk_api.VkApi):
+    """
+    VkApi which takes token from shared TokenBucket before each API call instead of fixed delay between calls,
+    so calls through vk_api and direct HTTP calls with the same token share one requests per second limit.
+    vk_api.VkApi holds its lock for the whole HTTP request, so calls from different threads would be sent one by one
+    and limited by response time, here the lock is replaced with no-op one and calls run concurrently (rate is kept
+    by TokenBucket, connections are kept by pooled HTTP session)
+    """
+
+    RPS_DELAY = 0
+
+    def __init__(self, *args, rate_limiter: TokenBucket, **kwargs) -> None:
+        """
+        Sets attribute rate_limiter, other arguments are passed to vk_api.VkApi
+        :param rate_limiter: TokenBucket object shared by all calls with this token
+        """
+        super().__init__(*args, **kwargs)
+        self.rate_limiter = rate_limiter
+        self.lock = nullcontext()
+
+    def method(self, method, values=None, *args, **kwargs):
+        """
+        Waits for rate limiter and calls API method, see vk_api.VkApi.method
+        """
+        self.rate_limiter.acquire()
+        return super().method(method, values, *args, **kwargs)
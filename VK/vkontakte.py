@@ -1,7 +1,65 @@
 import vk_api
-import requests
 import datetime
-from time import sleep
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+from vk_api.execute import VkFunction
+
+from VK.rate_limiter import TokenBucket, RateLimitedVkApi
+from VK.lru_cache import LRUCache
+from VK.http_session import create_session, HTTP_POOL_SIZE, HTTP_MAX_RETRIES, HTTP_BACKOFF_FACTOR, HTTP_TIMEOUT
+
+# users.get accepts up to 1000 users in user_ids parameter
+USERS_GET_LIMIT = 1000
+
+# friends.getMutual accepts up to 100 users in target_uids parameter
+MUTUAL_FRIENDS_TARGETS_LIMIT = 100
+
+# seconds during which once received users groups are taken from cache
+GROUPS_CACHE_TTL = 600
+
+# maximum quantity of users whose groups are kept in cache, least recently used ones are evicted first
+GROUPS_CACHE_SIZE = 1000
+
+# VK allows 3 requests per second for user token
+REQUESTS_PER_SECOND = 3
+
+# quantity of threads fetching photos of found users at the same time
+PHOTO_WORKERS = 4
+
+# execute runs up to 25 API calls, each user needs two of them (profile and marked photos)
+PHOTOS_EXECUTE_USERS = 12
+
+# VKScript returning ids, owners and likes of profile and marked photos for each of passed users
+vk_get_photos = VkFunction(args=('user_ids',), code='''
+    var user_ids = %(user_ids)s,
+        i = 0,
+        result = [],
+        profile, marked,
+        profile_ids, profile_owners, profile_likes,
+        marked_ids, marked_owners, marked_likes;
+
+    while (i < user_ids.length) {
+        profile = API.photos.get({"owner_id": user_ids[i], "album_id": "profile", "extended": 1});
+        marked = API.photos.getUserPhotos({"user_id": user_ids[i], "extended": 1});
+        profile_ids = []; profile_owners = []; profile_likes = [];
+        marked_ids = []; marked_owners = []; marked_likes = [];
+        if (profile) {
+            profile_ids = profile.items@.id;
+            profile_owners = profile.items@.owner_id;
+            profile_likes = profile.items@.likes;
+        }
+        if (marked) {
+            marked_ids = marked.items@.id;
+            marked_owners = marked.items@.owner_id;
+            marked_likes = marked.items@.likes;
+        }
+        result.push({"profile_ids": profile_ids, "profile_owners": profile_owners, "profile_likes": profile_likes,
+                     "marked_ids": marked_ids, "marked_owners": marked_owners, "marked_likes": marked_likes});
+        i = i + 1;
+    }
+
+    return result;
+''')
 
 
 class VkontakteApi:
@@ -11,10 +69,17 @@ class VkontakteApi:
     Attributes:
         user_token: str
                     users token used to get access to VkApi methods
-        vk_session: class vk_api.vk_api.VkApi object
+        http:       class requests.Session object
+                    pooled HTTP session with retries and timeout used for all requests to VK
+        rate_limiter:   class TokenBucket object
+                        shared by all API calls with user token to keep VK requests per second limit
+        vk_session: class RateLimitedVkApi (vk_api.vk_api.VkApi) object
                     used to create vk attribute and to create VkRequestsPool object
         vk:         class vk_api.vk_api.VkApiMethod object
                     used to call VkApi methods
+        groups_cache_ttl:   seconds during which once received users groups are taken from cache
+        groups_cache:       LRUCache with user id as key and tuple (receipt time, set of group ids) as value,
+                            keeps at most GROUPS_CACHE_SIZE users, entries older than groups_cache_ttl are not used
 
     Methods:
         get_user_info: gets info on VK user based in his id
@@ -23,23 +88,44 @@ class VkontakteApi:
         city indication
         search_people: gets list of VK users with open profiles based on indicated gender, city and age
         search_many_people: same as previous, but uses Vk Request Pool to get more search results
+        get_users_info_batch: gets info on any quantity of VK users with open profiles, up to 1000 users per request
+        take_3_photos: staticmethod, takes three most liked of photos
         get_3_photos: gets users profile and marked photos and takes three most liked of them
+        get_photos_batch: same as previous for up to 12 users in one request via execute method
+        get_photos_for_users: gets three most liked photos for any quantity of users with concurrent execute requests
         prepare_found_users_info: prepares list of users dicts from API to necessary for database form
         like_photo: likes requested photo by token user
         delete_like_photo: deletes likes from requested photo by token user
         check_like_presence: checks whether photo is liked by token user or not
         get_mutual_friends: checks how many mutual friends  do users have
+        get_mutual_friends_batch: checks how many mutual friends does user have with each of other users
         get_groups: get set of users groups ids
+        get_groups_cached: get set of users groups ids, repeated calls within groups_cache_ttl do not call API
+        get_groups_batch: get sets of groups ids for several users using Vk Request Pool
     """
 
-    def __init__(self, user_token: str) -> None:
+    def __init__(self, user_token: str, groups_cache_ttl: float = GROUPS_CACHE_TTL,
+                 pool_size: int = HTTP_POOL_SIZE, max_retries: int = HTTP_MAX_RETRIES,
+                 backoff_factor: float = HTTP_BACKOFF_FACTOR, timeout: float = HTTP_TIMEOUT,
+                 requests_per_second: float = REQUESTS_PER_SECOND) -> None:
         """
-        Sets attributes user_token, vk_session and vk for object VkontakteApi
+        Sets attributes user_token, http, rate_limiter, vk_session, vk, groups_cache_ttl and groups_cache for object
+        VkontakteApi
         :param user_token: str, users token with necessary rights ('wall' rights are obligatory)
+        :param groups_cache_ttl: seconds during which once received users groups are taken from cache
+        :param pool_size: quantity of kept open connections to VK
+        :param max_retries: quantity of retries of request failed with 5xx response, connection error or timeout
+        :param backoff_factor: delay between retries is backoff_factor * 2 ** (retry number - 1) seconds
+        :param timeout: seconds to wait for connection and response
+        :param requests_per_second: maximum rate of API calls, lower than VK limit if token is used by other processes
         """
         self.user_token = user_token
-        self.vk_session = vk_api.VkApi(token=self.user_token)
+        self.http = create_session(pool_size, max_retries, backoff_factor, timeout)
+        self.rate_limiter = TokenBucket(requests_per_second)
+        self.vk_session = RateLimitedVkApi(token=self.user_token, rate_limiter=self.rate_limiter, session=self.http)
         self.vk = self.vk_session.get_api()
+        self.groups_cache_ttl = groups_cache_ttl
+        self.groups_cache = LRUCache(GROUPS_CACHE_SIZE)
 
     def get_user_info(self, user_id: int) -> dict:
         """
@@ -140,7 +226,7 @@ class VkontakteApi:
     def search_many_people(self, city_id: int, sex: int, age: int) -> list:
         """
         Gets list of VK users with open profiles based on indicated gender, city and age. Uses Vk Request Pool to get
-        more search results
+        more search results. Results of failed requests of pool are skipped
         :param city_id: integer, city id used in VK database
         :param sex: integer, gender id used in VK database
         :param age: integer, age of searched users
@@ -161,10 +247,38 @@ class VkontakteApi:
 
         people_list = []
         for value in people.values():
-            people_list.extend(value.result['items'])
+            if value.ok:
+                people_list.extend(value.result['items'])
 
         return self.filter_search_results(people_list)
 
+    def get_users_info_batch(self, user_ids: list) -> list:
+        """
+        Gets info on VK users with the same fields as search methods, up to 1000 users in one users.get request.
+        Deleted and banned users, users with closed profiles, without full birthdate and city indication are skipped
+        :param user_ids: list of users ids
+        :return: list of dicts with users information
+        """
+        people_list = []
+        for i in range(0, len(user_ids), USERS_GET_LIMIT):
+            response = self.vk.users.get(user_ids=','.join(str(user_id) for user_id in user_ids[i:i + USERS_GET_LIMIT]),
+                                         fields='''activities, bdate, books, city, games, interests, movies,
+                                         music, personal, relation, sex, tv''')
+            people_list.extend(person for person in response if 'deactivated' not in person)
+
+        return self.filter_search_results(people_list)
+
+    @staticmethod
+    def take_3_photos(photos: list) -> list:
+        """
+        Takes three most liked of photos, if photo is repeated its last likes quantity is used
+        :param photos: list of tuples (photo id in form 'ownerid_photoid', likes quantity)
+        :return: list with three photo ids
+        """
+        photo_dict = dict(photos)
+        three_photos = sorted(photo_dict.items(), key=lambda x: x[1], reverse=True)[0:3]
+        return [photo[0] for photo in three_photos]
+
     def get_3_photos(self, user_id: int) -> list:
         """
         Gets users profile and marked photos and takes three most liked of them
@@ -173,9 +287,9 @@ class VkontakteApi:
         """
         response = self.vk.photos.get(owner_id=user_id, album_id='profile', extended=1)
 
-        photo_dict = {}
+        photos = []
         for photo in response['items']:
-            photo_dict[f"{photo['owner_id']}_{photo['id']}"] = photo['likes']['count']
+            photos.append((f"{photo['owner_id']}_{photo['id']}", photo['likes']['count']))
 
         # Get photos where user is marked
 
@@ -187,21 +301,57 @@ class VkontakteApi:
         #     response = {}
         # if response:
         #     for photo in response['items']:
-        #         photo_dict[f"{photo['owner_id']}_{photo['id']}"] = photo['likes']['count']
+        #         photos.append((f"{photo['owner_id']}_{photo['id']}", photo['likes']['count']))
 
         URL = 'https://api.vk.com/method/photos.getUserPhotos'
         params = {'user_id': user_id, 'extended': '1', 'access_token': self.user_token, 'v': '5.131'}
-        response = requests.get(URL, params=params).json()
+        self.rate_limiter.acquire()
+        response = self.http.get(URL, params=params).json()
 
         if 'error' in response:
             pass
         else:
             for photo in response['response']['items']:
-                photo_dict[f"{photo['owner_id']}_{photo['id']}"] = photo['likes']['count']
+                photos.append((f"{photo['owner_id']}_{photo['id']}", photo['likes']['count']))
 
-        three_photos = sorted(photo_dict.items(), key=lambda x: x[1], reverse=True)[0:3]
+        return self.take_3_photos(photos)
 
-        return [photo[0] for photo in three_photos]
+    def get_photos_batch(self, user_ids: list) -> dict:
+        """
+        Gets profile and marked photos of up to 12 users in one request via execute method and takes three most liked
+        photos of each user, result for each user is the same as get_3_photos one
+        :param user_ids: list of up to PHOTOS_EXECUTE_USERS users ids to search photos
+        :return: dict with user id as key and list with photo ids as value
+        """
+        response = vk_get_photos(self.vk_session, user_ids)
+
+        result = {}
+        for user_id, user_photos in zip(user_ids, response):
+            photos = []
+            for kind in ('profile', 'marked'):
+                for photo_id, owner_id, likes in zip(user_photos[f'{kind}_ids'] or [],
+                                                     user_photos[f'{kind}_owners'] or [],
+                                                     user_photos[f'{kind}_likes'] or []):
+                    photos.append((f'{owner_id}_{photo_id}', likes['count']))
+            result[user_id] = self.take_3_photos(photos)
+
+        return result
+
+    def get_photos_for_users(self, user_ids: list) -> dict:
+        """
+        Gets three most liked profile and marked photos for several users. Users are split into batches for execute
+        method (about 9 requests for 100 users instead of 200), batches are proceeded concurrently, requests rate is
+        limited by rate_limiter only
+        :param user_ids: list of users ids to search photos
+        :return: dict with user id as key and list with photo ids as value
+        """
+        batches = [user_ids[i:i + PHOTOS_EXECUTE_USERS] for i in range(0, len(user_ids), PHOTOS_EXECUTE_USERS)]
+
+        result = {}
+        with ThreadPoolExecutor(max_workers=PHOTO_WORKERS) as executor:
+            for photos in executor.map(self.get_photos_batch, batches):
+                result.update(photos)
+        return result
 
     def prepare_found_users_info(self, found_users: list) -> list:
         """
@@ -209,11 +359,12 @@ class VkontakteApi:
         :param found_users: list of dicts with found users info
         :return: list of dicts with prepared users info
         """
+        all_photos = self.get_photos_for_users([person['id'] for person in found_users])
+
         result = []
         for person in found_users:
 
-            photos = self.get_3_photos(person['id'])
-            sleep(0.34)
+            photos = all_photos[person['id']]
 
             if len(photos) < 3:
                 continue
@@ -300,6 +451,31 @@ class VkontakteApi:
         friends = self.vk.friends.getMutual(source_uid=uid, target_uid=other_uid)
         return len(friends)
 
+    def get_mutual_friends_batch(self, uid: int, other_uids: list) -> dict:
+        """
+        Returns how many mutual friends user has with each of other users. Uses target_uids parameter (up to 100 users
+        per call) and Vk Request Pool, so 100 users need one request instead of 100
+        :param uid: first user id
+        :param other_uids: list of other users ids
+        :return: dict with other users ids as keys and quantity of mutual friends as values (0 if friends are hidden)
+        """
+        responses = []
+        with vk_api.VkRequestsPool(self.vk_session) as pool:
+            for i in range(0, len(other_uids), MUTUAL_FRIENDS_TARGETS_LIMIT):
+                target_uids = other_uids[i:i + MUTUAL_FRIENDS_TARGETS_LIMIT]
+                responses.append(pool.method('friends.getMutual',
+                                             {'source_uid': uid, 'target_uids': ','.join(map(str, target_uids))}))
+
+        mutual_friends = {other_uid: 0 for other_uid in other_uids}
+        for response in responses:
+            if not response.ok:
+                continue
+            for item in response.result:
+                if item['id'] in mutual_friends:
+                    mutual_friends[item['id']] = item.get('common_count', len(item.get('common_friends', [])))
+
+        return mutual_friends
+
     def get_groups(self, uid: int) -> set:
         """
         Returns set of users groups ids
@@ -308,3 +484,30 @@ class VkontakteApi:
         """
         groups = self.vk.groups.get(user_id=uid, count=1000)
         return set(groups['items'])
+
+    def get_groups_cached(self, uid: int) -> set:
+        """
+        Returns set of users groups ids, received set is kept in cache and reused during groups_cache_ttl seconds
+        :param uid: user id
+        :return: set of group ids
+        """
+        cached = self.groups_cache.get(uid)
+        if cached and monotonic() - cached[0] < self.groups_cache_ttl:
+            return cached[1]
+
+        groups = self.get_groups(uid)
+        self.groups_cache[uid] = (monotonic(), groups)
+        return groups
+
+    def get_groups_batch(self, uids: list) -> dict:
+        """
+        Returns sets of groups ids for several users, requests are sent through Vk Request Pool (25 users per call)
+        :param uids: list of users ids
+        :return: dict with user id as key and set of group ids as value (empty set if users groups are hidden)
+        """
+        responses = {}
+        with vk_api.VkRequestsPool(self.vk_session) as pool:
+            for uid in uids:
+                responses[uid] = pool.method('groups.get', {'user_id': uid, 'count': 1000})
+
+        return {uid: set(response.result['items']) if response.ok else set() for uid, response in responses.items()}
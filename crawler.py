@@ -0,0 +1,58 @@
+import argparse
+import configparser
+
+from VK.vkontakte import VkontakteApi
+from DB.database import DB
+from Bot.candidate_pool import CandidatePool
+from Bot.crawler import Crawler, CRAWL_REQUESTS_PER_SECOND, CRAWL_INTERVAL, REFRESH_AGE, REFRESH_LIMIT
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='VKinder crawler, pre-populates database with found people for '
+                                                 'popular search parameters')
+    parser.add_argument('--once', action='store_true',
+                        help='crawl all search keys and refresh outdated found users once and exit')
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read('settings.ini')
+    user_token = config['VK']['token']
+    postgres_username = config['DB']['username']
+    postgres_password = config['DB']['password']
+
+    http_settings = {'pool_size': config.getint('HTTP', 'pool_size', fallback=10),
+                     'max_retries': config.getint('HTTP', 'max_retries', fallback=3),
+                     'backoff_factor': config.getfloat('HTTP', 'backoff_factor', fallback=0.5),
+                     'timeout': config.getfloat('HTTP', 'timeout', fallback=10),
+                     'requests_per_second': config.getfloat('CRAWLER', 'requests_per_second',
+                                                            fallback=CRAWL_REQUESTS_PER_SECOND)
+                     }
+
+    connect_info = {'drivername': 'postgresql+psycopg2',
+                    'username': postgres_username,
+                    'password': postgres_password,
+                    'host': 'localhost',
+                    'port': 5432,
+                    'database': 'vkinder',
+                    'pool_size': config.getint('DB', 'pool_size', fallback=10),
+                    'max_overflow': config.getint('DB', 'max_overflow', fallback=10),
+                    'pool_pre_ping': config.getboolean('DB', 'pool_pre_ping', fallback=True),
+                    'pool_recycle': config.getint('DB', 'pool_recycle', fallback=1800)
+                    }
+
+    interval = config.getfloat('CRAWLER', 'interval', fallback=CRAWL_INTERVAL)
+    refresh_age = config.getfloat('CRAWLER', 'refresh_age', fallback=REFRESH_AGE)
+    refresh_limit = config.getint('CRAWLER', 'refresh_limit', fallback=REFRESH_LIMIT)
+
+    db = DB(**connect_info)
+    if not db.create_table(db.preparation()):
+        print('Database is not ready, start bot first to create it')
+        raise SystemExit(1)
+    db.warm_up_cache()
+
+    crawler = Crawler(VkontakteApi(user_token, **http_settings), db, CandidatePool(db))
+    if args.once:
+        crawler.crawl()
+        crawler.refresh(refresh_age, refresh_limit)
+    else:
+        crawler.run(interval, refresh_age, refresh_limit)
@@ -0,0 +1,195 @@
+import numpy as np
+from typing import Optional, Sequence
+
+from interests.interests import InterestsComparison, WORDS_FIELDS, PHRASES_FIELDS
+
+
+class BatchScoring:
+    """
+    Class for evaluation of likeness of many found users with bot user at once.
+    Each InterestsComparison rule is computed as array operation over all found users, result is the same as sum of
+    InterestsComparison methods results for each found user
+
+    Attributes:
+        interests:  attribute for class InterestsComparison object, used to parse text of rows without fingerprints
+        text_weights: points (res1, res2, res3) for 1, 2-6 and 7+ mutual tokens in each text field
+
+    Methods:
+        score: returns array with likeness index of each found user
+        social_score: returns array with points for mutual friends and groups of each found user
+        top_k: returns indexes of k found users with highest index in descending order
+        encode: supplementary method to encode categorical field of found users as integer array
+        grade: supplementary method to return points based on conditions on array values
+        intersection_sizes: supplementary method to count mutual tokens of user and each found user in text field
+        languages_intersection_sizes: supplementary method to count mutual languages of user and each found user
+    """
+
+    text_weights = {'activities': (2, 4, 6),
+                    'interests': (2, 4, 6),
+                    'inspired_by': (1, 2, 3),
+                    'music': (2, 3, 4),
+                    'movies': (2, 3, 4),
+                    'tv': (1, 2, 3),
+                    'books': (1, 2, 3),
+                    'games': (1, 2, 3)}
+
+    def __init__(self, interests: Optional[InterestsComparison] = None) -> None:
+        """
+        Sets attribute interests for object BatchScoring
+        :param interests: InterestsComparison object, new one is created if not passed
+        """
+        self.interests = interests or InterestsComparison()
+
+    @staticmethod
+    def encode(found_users: Sequence[dict], field: str, fill: int) -> np.ndarray:
+        """
+        Encodes categorical field of found users as integer array
+        :param found_users: list of found users dicts
+        :param field: dict key of encoded field
+        :param fill: value used for absent (None) field, must not be equal to any meaningful value
+        :return: array with field values
+        """
+        return np.fromiter((fill if person.get(field) is None else int(person[field]) for person in found_users),
+                           dtype=np.int64, count=len(found_users))
+
+    @staticmethod
+    def grade(conditions: list, points: list) -> np.ndarray:
+        """
+        Supplementary method to return some number of points for each found user based on first true condition
+        :param conditions: list of boolean arrays
+        :param points: list of points corresponding to conditions
+        :return: array of points, 0 where no condition is true
+        """
+        return np.select(conditions, points, default=0).astype(np.int64)
+
+    def intersection_sizes(self, user_tokens: set, found_users: Sequence[dict], field: str,
+                           stop_words) -> np.ndarray:
+        """
+        Counts mutual tokens of user and each found user in text field, stored fingerprints are used if present
+        :param user_tokens: set of users tokens in this field
+        :param found_users: list of found users dicts
+        :param field: text field name
+        :param stop_words: collection of common insignificant stop words to be deleted from interests
+        :return: array with quantity of mutual tokens for each found user
+        """
+        if not user_tokens:
+            return np.zeros(len(found_users), dtype=np.int64)
+
+        def size(person: dict) -> int:
+            tokens = person.get(f'{field}_tokens')
+            if tokens is None:
+                text = person.get(field)
+                if not text:
+                    return 0
+                if field in WORDS_FIELDS:
+                    tokens = self.interests.tokenize_to_words(text, stop_words)
+                else:
+                    tokens = self.interests.tokenize_to_phrases(text)
+            return len(user_tokens.intersection(tokens))
+
+        return np.fromiter((size(person) for person in found_users), dtype=np.int64, count=len(found_users))
+
+    @staticmethod
+    def languages_intersection_sizes(user_languages: Optional[str], found_users: Sequence[dict]) -> np.ndarray:
+        """
+        Counts mutual languages of user and each found user, same parsing as InterestsComparison.compare_languages
+        :param user_languages: users languages
+        :param found_users: list of found users dicts
+        :return: array with quantity of mutual languages for each found user
+        """
+        if not user_languages:
+            return np.zeros(len(found_users), dtype=np.int64)
+        user_langs = set(user_languages[1:-1].split(','))
+        return np.fromiter((len(user_langs.intersection(person['langs'][1:-1].split(',')))
+                            if person.get('langs') else 0 for person in found_users),
+                           dtype=np.int64, count=len(found_users))
+
+    def score(self, user: dict, found_users: Sequence[dict], stop_words,
+              mutual_friends: Optional[Sequence[int]] = None,
+              mutual_groups: Optional[Sequence[int]] = None) -> np.ndarray:
+        """
+        Returns likeness index of each found user with bot user
+        :param user: bot user dict read from database
+        :param found_users: list of found users dicts read from database
+        :param stop_words: collection of common insignificant stop words to be deleted from interests
+        :param mutual_friends: quantities of mutual friends with each found user, not evaluated if not passed
+        :param mutual_groups: quantities of mutual groups with each found user, not evaluated if not passed
+        :return: array with likeness index of each found user, in found_users order
+        """
+        n = len(found_users)
+        scores = np.zeros(n, dtype=np.int64)
+        if not n:
+            return scores
+
+        for field in ('age', 'city'):
+            if user[field]:
+                scores += (self.encode(found_users, field, 0) == user[field]) * 13
+
+        relation = self.encode(found_users, 'relation', -1)
+        scores += self.grade([np.isin(relation, [1, 6]), relation == 0, np.isin(relation, [2, 3, 4, 7, 8])], [5, 2, -5])
+
+        languages = self.languages_intersection_sizes(user['langs'], found_users)
+        scores += self.grade([languages == 2, languages == 3, languages == 4, languages > 4], [1, 2, 3, 4])
+
+        user_tokens = self.interests.get_fingerprint(user, stop_words)
+        for field in WORDS_FIELDS + PHRASES_FIELDS:
+            res1, res2, res3 = self.text_weights[field]
+            sizes = self.intersection_sizes(user_tokens[field], found_users, field, stop_words)
+            scores += self.grade([sizes == 1, (sizes >= 2) & (sizes <= 6), sizes > 6], [res1, res2, res3])
+
+        for field in ('political', 'religion_id', 'life_main', 'people_main'):
+            if user[field]:
+                scores += (self.encode(found_users, field, 0) == user[field]) * 2
+
+        for field in ('smoking', 'alcohol'):
+            if user[field]:
+                addict = self.encode(found_users, field, 0)
+                difference = np.abs(addict - int(user[field]))
+                scores += self.grade([addict == 0, difference == 0, difference == 3, difference == 4], [0, 2, -1, -2])
+
+        return scores + self.social_score(n, mutual_friends, mutual_groups)
+
+    def social_score(self, n: int, mutual_friends: Optional[Sequence[int]] = None,
+                     mutual_groups: Optional[Sequence[int]] = None) -> np.ndarray:
+        """
+        Returns part of likeness index based on mutual friends and groups, used separately when the rest of index is
+        evaluated by database (see DB.read_top_found_users)
+        :param n: quantity of found users
+        :param mutual_friends: quantities of mutual friends with each found user, not evaluated if not passed
+        :param mutual_groups: quantities of mutual groups with each found user, not evaluated if not passed
+        :return: array with points of each found user
+        """
+        scores = np.zeros(n, dtype=np.int64)
+
+        if mutual_friends is not None:
+            friends = np.asarray(mutual_friends, dtype=np.int64)
+            scores += self.grade([(friends >= 1) & (friends <= 2), (friends >= 3) & (friends <= 5),
+                                  (friends >= 6) & (friends <= 10), friends > 10], [3, 8, 13, 18])
+
+        if mutual_groups is not None:
+            groups = np.asarray(mutual_groups, dtype=np.int64)
+            scores += self.grade([groups == 1, groups == 2, groups > 2], [1, 2, 3])
+
+        return scores
+
+    @staticmethod
+    def top_k(scores: np.ndarray, k: Optional[int] = None) -> np.ndarray:
+        """
+        Returns indexes of k found users with highest likeness index in descending order.
+        Found users with equal index keep their initial order (same as stable sort of all found users)
+        :param scores: array with likeness index of each found user
+        :param k: quantity of returned indexes, all found users are sorted if not passed
+        :return: array of indexes
+        """
+        n = len(scores)
+        positions = np.arange(n)
+        if k is None or k >= n:
+            return np.lexsort((positions, -scores))
+        if k <= 0:
+            return positions[:0]
+
+        threshold = scores[np.argpartition(scores, n - k)[n - k]]
+        above = np.flatnonzero(scores > threshold)
+        equal = np.flatnonzero(scores == threshold)[:k - len(above)]
+        selected = np.concatenate((above, equal))
+        return selected[np.lexsort((selected, -scores[selected]))]
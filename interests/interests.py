@@ -1,12 +1,63 @@
 import re
-import pymorphy2
+from functools import lru_cache
+from time import perf_counter
 from typing import Optional
 
+from interests.stopwords import get_stop_words
+
+# Maximum number of entries kept in the normalization caches, oldest ones are evicted first
+TOKEN_CACHE_SIZE = 100000
+STRING_CACHE_SIZE = 10000
+
+SPLIT_PATTERN = re.compile(r'[а-яёa-z]+(?:-[а-яёa-z]+)?', re.I)
+
+# Text fields compared by normalized words and by comma separated phrases,
+# their token sets are stored in database in '<field>_tokens' columns
+WORDS_FIELDS = ('activities', 'interests', 'inspired_by')
+PHRASES_FIELDS = ('music', 'movies', 'tv', 'books', 'games')
+
+
+@lru_cache(maxsize=None)
+def get_morph_analyzer():
+    """
+    Returns process-wide morphology analyzer, pymorphy2 is imported and dictionaries are loaded only on the first
+    call, so bot starts without waiting for them
+    :return: pymorphy2.MorphAnalyzer object
+    """
+    import pymorphy2
+    return pymorphy2.MorphAnalyzer()
+
+
+@lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def normalize_token(token: str) -> str:
+    """
+    Returns normal form of a single lowercase token
+    :param token: raw token
+    :return: normal form of the token
+    """
+    return get_morph_analyzer().parse(token)[0].normal_form
+
+
+@lru_cache(maxsize=STRING_CACHE_SIZE)
+def normalize_string(interests_string: str) -> tuple:
+    """
+    Splits text to words and normalizes them, stop words are not deleted here so result can be shared between
+    different stop lists
+    :param interests_string: string with interests
+    :return: tuple with normal forms of all words in text
+    """
+    interests_tokens = SPLIT_PATTERN.findall(interests_string.lower())
+    return tuple(normalize_token(token) for token in interests_tokens)
+
 
 class InterestsComparison:
     """
     Class for evaluation of users interests likeness with other users interests
 
+    Attributes:
+        stop_words: frozenset of common insignificant stop words to be deleted from interests, built once per process
+                    on first use
+
     Methods: most methods returns number of points to be added to total index of likeness
 
     compare_age: compares users and other user ages
@@ -19,12 +70,47 @@ class InterestsComparison:
     tokenize_to_phrases: splits text into phrases on commas
     compare_interests_words: compares some users and other users interest based on words split
     compare_interests_phrases: compares some users and other users interest based on phrases split
+    make_fingerprint: prepares token and phrase lists of user text fields to be stored in database
+    get_fingerprint: returns token and phrase sets of user text fields, stored ones are used if present
     compare_main_things: compares main things in life or people for user and other user
     compare_smoking_alcohol: compares relation to smoking or alcohol for user and other user
     evaluate_mutual_friends: evaluates quantity of users and other users mutual friends
     evaluate_mutual_groups: evaluates quantity of users and other users mutual groups
+    cache_info: returns hit/miss statistics of tokens and strings normalization caches
+    cache_report: returns normalization caches statistics as text
+    warm_up: loads stop words and morphology dictionaries in advance
     """
 
+    def __init__(self, stop_words: Optional[frozenset] = None) -> None:
+        """
+        Sets attribute stop_words for object InterestsComparison
+        :param stop_words: set of stop words, stop words from stopwords.py are used if not passed
+        """
+        self._stop_words = stop_words
+
+    @property
+    def stop_words(self) -> frozenset:
+        """
+        Returns stop words, shared set from stopwords.py is built on first use
+        """
+        if self._stop_words is None:
+            self._stop_words = get_stop_words()
+        return self._stop_words
+
+    @staticmethod
+    def warm_up() -> dict:
+        """
+        Loads stop words and morphology dictionaries which are otherwise loaded on first ranking
+        :return: dict with phase name as key and seconds spent as value
+        """
+        timings = {}
+        for phase, function in (('stop words', get_stop_words),
+                                ('morphology', lambda: get_morph_analyzer().parse('проверка'))):
+            started = perf_counter()
+            function()
+            timings[phase] = perf_counter() - started
+        return timings
+
     @staticmethod
     def compare_age(user_age: Optional[int], found_user_age: int) -> int:
         """
@@ -105,21 +191,15 @@ class InterestsComparison:
         return 0
 
     @staticmethod
-    def tokenize_to_words(interests_string: str, stop_words: list) -> set:
+    def tokenize_to_words(interests_string: str, stop_words: frozenset) -> set:
         """
         Splits text to words, normalizes them and deletes short ones and included in stop list
         :param interests_string: string with interests
-        :param stop_words: list of common insignificant stop words to be deleted from interests
+        :param stop_words: set of common insignificant stop words to be deleted from interests
         :return: set with interest based words
         """
-        split_pattern = re.compile(r'[а-яёa-z]+(?:-[а-яёa-z]+)?', re.I)
-        interests_tokens = split_pattern.findall(interests_string.lower())
-        morph = pymorphy2.MorphAnalyzer()
-        normalized_tokens = []
-        for token in interests_tokens:
-            normalized_tokens.append(morph.parse(token)[0].normal_form)
-        normalized_tokens = [token for token in normalized_tokens if token not in stop_words and len(token) > 2]
-        result = set(normalized_tokens)
+        normalized_tokens = normalize_string(interests_string)
+        result = {token for token in normalized_tokens if token not in stop_words and len(token) > 2}
         return result
 
     @staticmethod
@@ -133,12 +213,12 @@ class InterestsComparison:
         return set(tokens)
 
     def compare_interests_words(self, user_interests: Optional[str], found_user_interests: Optional[str],
-                                stop_words: list, res1: int, res2: int, res3: int) -> int:
+                                stop_words: frozenset, res1: int, res2: int, res3: int) -> int:
         """
         Compares some users and other users interest based on words split, used for activities, interests, inspiration
         :param user_interests: string with users interests
         :param found_user_interests: string with found users interests
-        :param stop_words: list of common insignificant stop words to be deleted from interests
+        :param stop_words: set of common insignificant stop words to be deleted from interests
         :param res1: result1 based on intersection len
         :param res2: result2 based on intersection len
         :param res3: result3 based on intersection len
@@ -171,6 +251,45 @@ class InterestsComparison:
             return evaluated_intersection
         return 0
 
+    def make_fingerprint(self, person: dict, stop_words) -> dict:
+        """
+        Prepares token and phrase lists of user text fields to be stored in database, so they are not parsed again
+        on each search
+        :param person: dict with user text fields (activities, interests, inspired_by, music, movies, tv, books, games)
+        :param stop_words: collection of common insignificant stop words to be deleted from interests
+        :return: dict with '<field>_tokens' keys and sorted lists of tokens (None if field is empty)
+        """
+        fingerprint = {}
+        for field in WORDS_FIELDS:
+            text = person.get(field)
+            fingerprint[f'{field}_tokens'] = sorted(self.tokenize_to_words(text, stop_words)) if text else None
+        for field in PHRASES_FIELDS:
+            text = person.get(field)
+            fingerprint[f'{field}_tokens'] = sorted(self.tokenize_to_phrases(text)) if text else None
+        return fingerprint
+
+    def get_fingerprint(self, person: dict, stop_words) -> dict:
+        """
+        Returns token and phrase sets of user text fields. Sets stored in database are used if present,
+        otherwise text is parsed (for rows written before fingerprints were introduced)
+        :param person: dict with user info read from database
+        :param stop_words: collection of common insignificant stop words to be deleted from interests
+        :return: dict with field names as keys and sets of tokens as values
+        """
+        fingerprint = {}
+        for field in WORDS_FIELDS + PHRASES_FIELDS:
+            tokens = person.get(f'{field}_tokens')
+            text = person.get(field)
+            if tokens is not None:
+                fingerprint[field] = set(tokens)
+            elif not text:
+                fingerprint[field] = set()
+            elif field in WORDS_FIELDS:
+                fingerprint[field] = self.tokenize_to_words(text, stop_words)
+            else:
+                fingerprint[field] = self.tokenize_to_phrases(text)
+        return fingerprint
+
     @staticmethod
     def compare_main_things(user_main: Optional[int], found_user_main: Optional[int]) -> int:
         """
@@ -231,3 +350,27 @@ class InterestsComparison:
         elif len(mutual_groups) > 2:
             return 3
         return 0
+
+    @staticmethod
+    def cache_info() -> dict:
+        """
+        Returns hit/miss statistics of normalization caches shared by all InterestsComparison objects
+        :return: dict with 'tokens' and 'strings' keys, values are functools lru_cache statistics
+        (hits, misses, maxsize, currsize)
+        """
+        return {'tokens': normalize_token.cache_info(),
+                'strings': normalize_string.cache_info()}
+
+    @staticmethod
+    def cache_report() -> str:
+        """
+        Returns normalization caches statistics as text, one line per cache
+        :return: str with hits, misses, hit rate and filling of each cache
+        """
+        lines = []
+        for name, info in InterestsComparison.cache_info().items():
+            requests = info.hits + info.misses
+            hit_rate = info.hits / requests if requests else 0
+            lines.append(f'{name} cache: {info.hits} hits, {info.misses} misses, hit rate {hit_rate:.1%}, '
+                         f'size {info.currsize}/{info.maxsize}')
+        return '\n'.join(lines)
@@ -1,5 +1,37 @@
 from vk_api.keyboard import VkKeyboard, VkKeyboardColor
 
+# ages offered on keyboard, 3 buttons in a line
+AGES = (20, 25, 30, 35, 40, 45, 50, 60, 70)
+
+# cities offered on keyboard with their ids used in VK database, 2 buttons in a line
+CITIES = {'Москва': 1, 'Санкт-Петербург': 2, 'Казань': 60, 'Ростов-на-Дону': 119, 'Махачкала': 85,
+          'Екатеринбург': 49, 'Новосибирск': 99, 'Норильск': 102, 'Владивосток': 37, 'Якутск': 168}
+
+
+def add_age_buttons(keyboard: VkKeyboard) -> None:
+    """
+    Adds to keyboard age buttons (mask 'возраст ...') for ages from AGES
+    :param keyboard: VkKeyboard object
+    :return:
+    """
+    for i in range(0, len(AGES), 3):
+        for age in AGES[i:i + 3]:
+            keyboard.add_button(f'возраст {age}', color=VkKeyboardColor.SECONDARY)
+        keyboard.add_line()
+
+
+def add_city_buttons(keyboard: VkKeyboard) -> None:
+    """
+    Adds to keyboard city buttons (mask 'г. ...') for cities from CITIES
+    :param keyboard: VkKeyboard object
+    :return:
+    """
+    cities = list(CITIES)
+    for i in range(0, len(cities), 2):
+        for city in cities[i:i + 2]:
+            keyboard.add_button(f'г. {city}', color=VkKeyboardColor.SECONDARY)
+        keyboard.add_line()
+
 
 def create_favourite_start_keyboard() -> dict:
     """
@@ -47,33 +79,8 @@ def create_age_city_keyboard() -> dict:
     :return: keyboard json
     """
     keyboard = VkKeyboard(one_time=False)
-    keyboard.add_button('возраст 20', color=VkKeyboardColor.SECONDARY)
-    keyboard.add_button('возраст 25', color=VkKeyboardColor.SECONDARY)
-    keyboard.add_button('возраст 30', color=VkKeyboardColor.SECONDARY)
-    keyboard.add_line()
-    keyboard.add_button('возраст 35', color=VkKeyboardColor.SECONDARY)
-    keyboard.add_button('возраст 40', color=VkKeyboardColor.SECONDARY)
-    keyboard.add_button('возраст 45', color=VkKeyboardColor.SECONDARY)
-    keyboard.add_line()
-    keyboard.add_button('возраст 50', color=VkKeyboardColor.SECONDARY)
-    keyboard.add_button('возраст 60', color=VkKeyboardColor.SECONDARY)
-    keyboard.add_button('возраст 70', color=VkKeyboardColor.SECONDARY)
-    keyboard.add_line()
-    keyboard.add_button('г. Москва', color=VkKeyboardColor.SECONDARY)
-    keyboard.add_button('г. Санкт-Петербург', color=VkKeyboardColor.SECONDARY)
-    keyboard.add_line()
-    keyboard.add_button('г. Казань', color=VkKeyboardColor.SECONDARY)
-    keyboard.add_button('г. Ростов-на-Дону', color=VkKeyboardColor.SECONDARY)
-    keyboard.add_line()
-    keyboard.add_button('г. Махачкала', color=VkKeyboardColor.SECONDARY)
-    keyboard.add_button('г. Екатеринбург', color=VkKeyboardColor.SECONDARY)
-    keyboard.add_line()
-    keyboard.add_button('г. Новосибирск', color=VkKeyboardColor.SECONDARY)
-    keyboard.add_button('г. Норильск', color=VkKeyboardColor.SECONDARY)
-    keyboard.add_line()
-    keyboard.add_button('г. Владивосток', color=VkKeyboardColor.SECONDARY)
-    keyboard.add_button('г. Якутск', color=VkKeyboardColor.SECONDARY)
-    keyboard.add_line()
+    add_age_buttons(keyboard)
+    add_city_buttons(keyboard)
     keyboard.add_button('search', color=VkKeyboardColor.PRIMARY)
     return keyboard.get_keyboard()
 
@@ -84,18 +91,7 @@ def create_age_keyboard() -> dict:
     :return: keyboard json
     """
     keyboard = VkKeyboard(one_time=False)
-    keyboard.add_button('возраст 20', color=VkKeyboardColor.SECONDARY)
-    keyboard.add_button('возраст 25', color=VkKeyboardColor.SECONDARY)
-    keyboard.add_button('возраст 30', color=VkKeyboardColor.SECONDARY)
-    keyboard.add_line()
-    keyboard.add_button('возраст 35', color=VkKeyboardColor.SECONDARY)
-    keyboard.add_button('возраст 40', color=VkKeyboardColor.SECONDARY)
-    keyboard.add_button('возраст 45', color=VkKeyboardColor.SECONDARY)
-    keyboard.add_line()
-    keyboard.add_button('возраст 50', color=VkKeyboardColor.SECONDARY)
-    keyboard.add_button('возраст 60', color=VkKeyboardColor.SECONDARY)
-    keyboard.add_button('возраст 70', color=VkKeyboardColor.SECONDARY)
-    keyboard.add_line()
+    add_age_buttons(keyboard)
     keyboard.add_button('search', color=VkKeyboardColor.PRIMARY)
     return keyboard.get_keyboard()
 
@@ -106,21 +102,7 @@ def create_city_keyboard() -> dict:
     :return: keyboard json
     """
     keyboard = VkKeyboard(one_time=False)
-    keyboard.add_button('г. Москва', color=VkKeyboardColor.SECONDARY)
-    keyboard.add_button('г. Санкт-Петербург', color=VkKeyboardColor.SECONDARY)
-    keyboard.add_line()
-    keyboard.add_button('г. Казань', color=VkKeyboardColor.SECONDARY)
-    keyboard.add_button('г. Ростов-на-Дону', color=VkKeyboardColor.SECONDARY)
-    keyboard.add_line()
-    keyboard.add_button('г. Махачкала', color=VkKeyboardColor.SECONDARY)
-    keyboard.add_button('г. Екатеринбург', color=VkKeyboardColor.SECONDARY)
-    keyboard.add_line()
-    keyboard.add_button('г. Новосибирск', color=VkKeyboardColor.SECONDARY)
-    keyboard.add_button('г. Норильск', color=VkKeyboardColor.SECONDARY)
-    keyboard.add_line()
-    keyboard.add_button('г. Владивосток', color=VkKeyboardColor.SECONDARY)
-    keyboard.add_button('г. Якутск', color=VkKeyboardColor.SECONDARY)
-    keyboard.add_line()
+    add_city_buttons(keyboard)
     keyboard.add_button('search', color=VkKeyboardColor.PRIMARY)
     return keyboard.get_keyboard()
 
@@ -1,9 +1,19 @@
+import argparse
 import configparser
-
-from Bot.vk_bot import BotApi
+from time import perf_counter
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='VKinder bot')
+    parser.add_argument('--warmup', action='store_true',
+                        help='load all resources before answering messages and print time of each start phase')
+    args = parser.parse_args()
+
+    # bot is imported after arguments parsing to measure import time
+    started = perf_counter()
+    from Bot.vk_bot import BotApi, BOT_REQUESTS_PER_SECOND
+    timings = {'imports': perf_counter() - started} if args.warmup else None
+
     config = configparser.ConfigParser()
     config.read('settings.ini')
     user_token = config['VK']['token']
@@ -11,14 +21,36 @@ if __name__ == '__main__':
     postgres_username = config['DB']['username']
     postgres_password = config['DB']['password']
 
+    http_settings = {'pool_size': config.getint('HTTP', 'pool_size', fallback=10),
+                     'max_retries': config.getint('HTTP', 'max_retries', fallback=3),
+                     'backoff_factor': config.getfloat('HTTP', 'backoff_factor', fallback=0.5),
+                     'timeout': config.getfloat('HTTP', 'timeout', fallback=10),
+                     'requests_per_second': config.getfloat('HTTP', 'requests_per_second',
+                                                            fallback=BOT_REQUESTS_PER_SECOND)
+                     }
+
     connect_info = {'drivername': 'postgresql+psycopg2',
                     'username': postgres_username,
                     'password': postgres_password,
                     'host': 'localhost',
                     'port': 5432,
-                    'database': 'vkinder'
+                    'database': 'vkinder',
+                    'pool_size': config.getint('DB', 'pool_size', fallback=10),
+                    'max_overflow': config.getint('DB', 'max_overflow', fallback=10),
+                    'pool_pre_ping': config.getboolean('DB', 'pool_pre_ping', fallback=True),
+                    'pool_recycle': config.getint('DB', 'pool_recycle', fallback=1800)
                     }
 
-    vkontakte_bot = BotApi(user_token, bot_token, **connect_info)
+    sql_scoring_limit = config.getint('SEARCH', 'sql_scoring_limit', fallback=0)
+
+    state_settings = {'backend': config.get('STATE', 'backend', fallback='memory'),
+                      'max_size': config.getint('STATE', 'max_size', fallback=10000),
+                      'ttl': config.getint('STATE', 'ttl', fallback=86400)
+                      }
+
+    started = perf_counter()
+    vkontakte_bot = BotApi(user_token, bot_token, http_settings, sql_scoring_limit, state_settings, **connect_info)
+    if timings is not None:
+        timings['bot creation'] = perf_counter() - started
 
-    vkontakte_bot.run_bot()
+    vkontakte_bot.run_bot(timings)
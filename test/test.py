@@ -1,2 +1,145 @@
+import random
+
+import numpy as np
 import pytest
 
+import interests.interests as interests_module
+from interests.batch_scoring import BatchScoring
+from interests.interests import InterestsComparison
+
+STOP_WORDS = frozenset(['это', 'очень', 'the', 'and'])
+
+WORDS = ['спорт', 'музыка', 'книги', 'путешествия', 'кино', 'это', 'очень', 'программирование', 'рыбалка', 'йога']
+PHRASES = ['rock', 'jazz', 'pop', 'метал', 'классика', 'рэп', 'blues', 'folk']
+LANGUAGES = ['Русский', 'English', 'Deutsch', 'Français', 'Español', 'Italiano']
+
+INT_FIELDS = ('political', 'religion_id', 'life_main', 'people_main', 'smoking', 'alcohol')
+
+
+class LowercaseMorphAnalyzer:
+    """
+    Morphology analyzer returning word itself as normal form, scalar and batch scoring share normalization, so their
+    equality does not depend on dictionaries
+    """
+
+    class Parse:
+        def __init__(self, word):
+            self.normal_form = word
+
+    def parse(self, word):
+        return [self.Parse(word)]
+
+
+@pytest.fixture(autouse=True)
+def morph_analyzer(monkeypatch):
+    monkeypatch.setattr(interests_module, 'get_morph_analyzer', LowercaseMorphAnalyzer)
+    interests_module.normalize_token.cache_clear()
+    interests_module.normalize_string.cache_clear()
+    yield
+    interests_module.normalize_token.cache_clear()
+    interests_module.normalize_string.cache_clear()
+
+
+@pytest.fixture
+def interests():
+    return InterestsComparison(STOP_WORDS)
+
+
+def scalar_score(interests, user, found_user, mutual_friends, mutual_groups):
+    """
+    Likeness index evaluated one found user at a time with InterestsComparison methods, as before BatchScoring
+    """
+    count = 0
+    count += interests.compare_age(user['age'], found_user['age'])
+    count += interests.compare_city(user['city'], found_user['city'])
+    count += interests.evaluate_relations(found_user['relation'])
+    count += interests.compare_languages(user['langs'], found_user['langs'])
+
+    count += interests.compare_interests_words(user['activities'], found_user['activities'], STOP_WORDS, 2, 4, 6)
+    count += interests.compare_interests_words(user['interests'], found_user['interests'], STOP_WORDS, 2, 4, 6)
+    count += interests.compare_interests_words(user['inspired_by'], found_user['inspired_by'], STOP_WORDS, 1, 2, 3)
+
+    count += interests.compare_interests_phrases(user['music'], found_user['music'], 2, 3, 4)
+    count += interests.compare_interests_phrases(user['movies'], found_user['movies'], 2, 3, 4)
+    count += interests.compare_interests_phrases(user['tv'], found_user['tv'], 1, 2, 3)
+    count += interests.compare_interests_phrases(user['books'], found_user['books'], 1, 2, 3)
+    count += interests.compare_interests_phrases(user['games'], found_user['games'], 1, 2, 3)
+
+    for field in ('political', 'religion_id', 'life_main', 'people_main'):
+        count += interests.compare_main_things(user[field], found_user[field])
+    for field in ('smoking', 'alcohol'):
+        count += interests.compare_smoking_alcohol(user[field], found_user[field])
+
+    count += interests.evaluate_mutual_friends(mutual_friends)
+    count += interests.evaluate_mutual_groups(set(range(mutual_groups)))
+    return count
+
+
+def random_text(rng, vocabulary, separator):
+    choice = rng.random()
+    if choice < 0.15:
+        return None
+    if choice < 0.25:
+        return ''
+    return separator.join(rng.sample(vocabulary, rng.randint(1, len(vocabulary))))
+
+
+def random_person(rng):
+    person = {'age': rng.choice([None, 0, 25, 30]),
+              'city': rng.choice([None, 0, 1, 2]),
+              'relation': rng.choice([None, 0, 1, 2, 3, 4, 5, 6, 7, 8]),
+              'langs': rng.choice([None, '', '[' + ','.join(rng.sample(LANGUAGES, rng.randint(1, 6))) + ']'])}
+    for field in INT_FIELDS:
+        person[field] = rng.choice([None, 0, 1, 2, 3, 4, 5])
+    for field in interests_module.WORDS_FIELDS:
+        person[field] = random_text(rng, WORDS, ' ')
+    for field in interests_module.PHRASES_FIELDS:
+        person[field] = random_text(rng, PHRASES, ', ')
+    return person
+
+
+def empty_person():
+    person = {field: None for field in ('age', 'city', 'relation', 'langs') + INT_FIELDS}
+    person.update({field: None for field in interests_module.WORDS_FIELDS + interests_module.PHRASES_FIELDS})
+    return person
+
+
+@pytest.mark.parametrize('seed', range(20))
+@pytest.mark.parametrize('stored_tokens', [False, True])
+def test_batch_score_equals_scalar_score(interests, seed, stored_tokens):
+    rng = random.Random(seed)
+    user = random_person(rng)
+    found_users = [random_person(rng) for _ in range(50)] + [empty_person()]
+    if stored_tokens:
+        for person in [user] + found_users:
+            person.update(interests.make_fingerprint(person, STOP_WORDS))
+    mutual_friends = [rng.choice([0, 1, 2, 3, 5, 6, 10, 11, 50]) for _ in found_users]
+    mutual_groups = [rng.choice([0, 1, 2, 3, 10]) for _ in found_users]
+
+    scores = BatchScoring(interests).score(user, found_users, STOP_WORDS, mutual_friends, mutual_groups)
+
+    expected = [scalar_score(interests, user, found_user, friends, groups)
+                for found_user, friends, groups in zip(found_users, mutual_friends, mutual_groups)]
+    assert scores.tolist() == expected
+
+
+def test_batch_score_of_empty_user(interests):
+    found_users = [random_person(random.Random(seed)) for seed in range(10)] + [empty_person()]
+
+    scores = BatchScoring(interests).score(empty_person(), found_users, STOP_WORDS, [0] * 11, [0] * 11)
+
+    expected = [scalar_score(interests, empty_person(), found_user, 0, 0) for found_user in found_users]
+    assert scores.tolist() == expected
+
+
+def test_batch_score_without_found_users(interests):
+    assert BatchScoring(interests).score(empty_person(), [], STOP_WORDS).tolist() == []
+
+
+@pytest.mark.parametrize('k', [None, 0, 1, 3, 7, 20, 100])
+def test_top_k_keeps_order_of_ties(k):
+    scores = np.array([5, 3, 5, 8, 3, 3, 8, 0, 5, 1, 8, 3, 5, 0, 2, 5, 3, 8, 1, 5])
+    stable_order = sorted(range(len(scores)), key=lambda i: -scores[i])
+
+    expected = stable_order if k is None else stable_order[:k]
+    assert BatchScoring.top_k(scores, k).tolist() == expected
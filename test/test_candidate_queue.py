@@ -0,0 +1,223 @@
+import threading
+
+import pytest
+
+from Bot.candidate_queue import CandidateQueue
+from Bot.state_store import CandidateQueueStore, MemoryStateStore, create_candidate_queue_store, OWNER_TTL
+
+UID = 1
+
+
+class HookedStateStore(MemoryStateStore):
+    """
+    MemoryStateStore running injected function once right after state is read or right before it is compared and set,
+    used to reproduce interleaving of bot processes
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.after_get = None
+        self.before_compare_and_set = None
+
+    def get(self, key, default=None):
+        value = super().get(key, default)
+        hook, self.after_get = self.after_get, None
+        if hook is not None:
+            hook()
+        return value
+
+    def compare_and_set(self, key, value, expected: dict) -> bool:
+        hook, self.before_compare_and_set = self.before_compare_and_set, None
+        if hook is not None:
+            hook()
+        return super().compare_and_set(key, value, expected)
+
+
+def shared_stores(n=2):
+    """
+    Returns CandidateQueueStore objects of n working bot processes sharing rankings, cursors and heartbeats
+    """
+    rankings, cursors, owners = MemoryStateStore(), HookedStateStore(), MemoryStateStore(ttl=OWNER_TTL)
+    stores = [CandidateQueueStore(MemoryStateStore(), rankings, cursors, owners) for _ in range(n)]
+    for store in stores:
+        store.beat()
+    return stores
+
+
+def pop_all(store, uid=UID):
+    ids = []
+    while (found_user_id := store.pop(uid, 0)) is not None:
+        ids.append(found_user_id)
+    return ids
+
+
+def test_queue_gives_highest_score_first_and_keeps_push_order_of_ties():
+    queue = CandidateQueue()
+    queue.push([5, 8, 5, 1], [10, 11, 12, 13])
+    queue.push([8], [14])
+
+    assert queue.ranking() == [11, 14, 10, 12, 13]
+    assert queue.peek(2) == [11, 14]
+    assert [queue.pop(0) for _ in range(5)] == [11, 14, 10, 12, 13]
+    assert queue.current == 13
+
+
+def test_queue_skips_already_pushed_found_users():
+    queue = CandidateQueue()
+    assert queue.push([1, 2], [10, 11]) == 2
+    queue.pop(0)
+    assert queue.push([9, 9, 3], [10, 11, 12]) == 1
+    assert queue.ranking() == [12, 10]
+
+
+def test_queue_add_scores_reorders_not_given_found_users():
+    queue = CandidateQueue()
+    queue.push([5, 4, 3], [10, 11, 12])
+    queue.pop(0)
+
+    assert queue.add_scores([7, 0, 3], [10, 11, 12]) == 1
+    assert queue.ranking() == [12, 11]
+
+
+def test_queue_discard_and_finish():
+    queue = CandidateQueue()
+    queue.push([3, 2, 1], [10, 11, 12])
+    queue.discard([10, 12])
+
+    assert queue.pop(0) == 11
+    assert queue.pop(0) is None
+    assert not queue.finished
+    queue.finish()
+    assert queue.pop() is None
+
+
+def test_queue_pop_waits_for_pushed_found_users():
+    queue = CandidateQueue()
+    threading.Timer(0.05, queue.push, ([1], [10])).start()
+    assert queue.pop(5) == 10
+
+
+def test_queue_calls_on_change():
+    queue = CandidateQueue()
+    changes = []
+    queue.on_change = lambda: changes.append(queue.ranking())
+
+    queue.push([1, 2], [10, 11])
+    queue.push([3], [10])
+    queue.add_scores([5], [10])
+    queue.finish()
+
+    assert changes == [[11, 10], [10, 11], [10, 11]]
+
+
+def test_local_store():
+    store = create_candidate_queue_store()
+    queue = CandidateQueue()
+    store[UID] = queue
+    queue.push([2, 1], [10, 11])
+
+    assert UID in store
+    assert store.pop(UID, 0) == 10
+    assert store.current(UID) == 10
+    assert store.peek(UID, 5) == [11]
+    assert not store.finished(UID)
+    queue.finish()
+    assert store.finished(UID)
+    del store[UID]
+    assert UID not in store
+
+
+def test_shared_store_is_continued_by_other_process():
+    owner, other = shared_stores()
+    queue = CandidateQueue()
+    owner[UID] = queue
+    queue.push([4, 3, 2, 1], [10, 11, 12, 13])
+
+    assert owner.pop(UID, 0) == 10
+    assert other.current(UID) == 10
+    assert other.peek(UID, 2) == [11, 12]
+    assert other.pop(UID, 0) == 11
+
+    queue.push([9], [14])
+    queue.finish()
+    assert pop_all(other) == [14, 12, 13]
+    assert other.finished(UID)
+
+
+def test_shared_store_does_not_give_found_users_twice_after_new_version():
+    owner, other = shared_stores()
+    queue = CandidateQueue()
+    owner[UID] = queue
+    queue.push([5, 4, 3], [10, 11, 12])
+
+    given = [other.pop(UID, 0), owner.pop(UID, 0)]
+    queue.push([1, 9], [13, 14])
+    queue.finish()
+
+    given += pop_all(other)
+    assert given == [10, 11, 14, 12, 13]
+
+
+@pytest.mark.parametrize('given_before', [0, 1])
+def test_shared_store_pop_retries_when_new_version_is_saved_after_cursor_is_read(given_before):
+    owner, other = shared_stores()
+    queue = CandidateQueue()
+    owner[UID] = queue
+    queue.push([5, 4, 3], [10, 11, 12])
+    given = [other.pop(UID, 0) for _ in range(given_before)]
+
+    other.cursors.before_compare_and_set = lambda: queue.push([1], [13])
+    given.append(other.pop(UID, 0))
+
+    assert not other.finished(UID)
+    assert other.peek(UID, 5) == [11, 12, 13][given_before:]
+    queue.finish()
+    given += pop_all(other)
+    assert given == [10, 11, 12, 13]
+    assert other.finished(UID)
+
+
+def test_shared_store_pop_reads_cursor_again_when_its_ranking_is_replaced():
+    owner, other = shared_stores()
+    queue = CandidateQueue()
+    owner[UID] = queue
+    queue.push([5, 4, 3], [10, 11, 12])
+
+    other.cursors.after_get = lambda: queue.push([1], [13])
+    assert other.pop(UID, 0) == 10
+    assert not other.finished(UID)
+    assert pop_all(other) == [11, 12, 13]
+
+
+def test_shared_store_delete():
+    owner, other = shared_stores()
+    owner[UID] = CandidateQueue()
+
+    del other[UID]
+    assert UID not in owner
+    assert not other.rankings.items
+
+
+def test_shared_store_ranking_of_stopped_process_is_finished():
+    owner, other = shared_stores()
+    queue = CandidateQueue()
+    owner[UID] = queue
+    queue.push([2, 1], [10, 11])
+
+    assert other.pop(UID, 0) == 10
+    assert not other.finished(UID)
+
+    del other.owners[owner.owner]
+    assert other.pop(UID, 0) == 11
+    assert other.pop(UID) is None
+    assert other.finished(UID)
+
+
+def test_shared_store_ranking_of_evicted_local_queue_is_finished():
+    owner, = shared_stores(1)
+    owner[UID] = CandidateQueue()
+    assert not owner.finished(UID)
+
+    del owner.queues[UID]
+    assert owner.pop(UID) is None
+    assert owner.finished(UID)